@@ -12,9 +12,12 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 
 SECRET_KEY = os.getenv('SECRET_KEY')
+# Запуск тестов (manage.py test)
+TESTING = sys.argv[1:2] == ['test']
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,25 +49,33 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'hospital_app',
     'users',
-    "debug_toolbar",
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'hospital_app.middleware.StaticFilesMiddleware',
+    'hospital_app.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hospital_app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+if DEBUG:
+    # Панель отладки только синхронная: в цепочке middleware она заставляет ASGI
+    # выполнять каждый запрос, в том числе к async-представлениям, в отдельном потоке
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = 'hospital.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Движок шаблонов Django с замером времени отрисовки для /metrics
+        'BACKEND': 'hospital_app.metrics.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates',
         ],
@@ -116,6 +127,14 @@ DATABASES = {
 
 }
 
+# Роли, справочник врачей и свободные слоты сбрасываются сигналами, поэтому при нескольких воркерах
+# кеш должен быть общим - Redis из REDIS_URL. Без него кеш в памяти процесса (разработка, тесты, один воркер)
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -150,11 +169,26 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'static/'
+# collectstatic добавляет к именам хеш содержимого и пишет рядом сжатые копии .gz/.br
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'hospital_app.storage.CompressedManifestStaticFilesStorage'},
+}
+if TESTING:
+    # Тесты не запускают collectstatic: ссылки на статику без манифеста и хешей
+    STORAGES['staticfiles'] = {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}
 # STATICFILES_DIRS = [
 #     BASE_DIR / 'static',
 # ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Кто передаёт файл медиа после проверки доступа: None - Django (FileResponse, sendfile через
+# wsgi.file_wrapper), 'x-accel-redirect' - nginx, 'x-sendfile' - Apache mod_xsendfile/lighttpd
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+# internal-location nginx, указывающий на MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Файлы медиа, открытые всем: картинки сайта и заглушка фото профиля
+MEDIA_PUBLIC_PATHS = ['photos/', 'users/default.png']
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -168,3 +202,34 @@ LOGIN_URL = 'users:login'
 AUTH_USER_MODEL = 'users.User'
 
 DEFAULT_USER_IMAGE = MEDIA_URL + 'users/default.png'
+
+# Токен сборщика Prometheus для /metrics (заголовок Authorization: Bearer ...); без него - только staff
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Профилирование запросов cProfile (hospital_app.profiling): доля случайных запросов и заголовок,
+# которым staff профилирует свой запрос. Выключено, пока оба не заданы
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_HEADER = os.getenv('PROFILING_HEADER') or None
+# 'prof' - файл pstats (snakeviz, python -m pstats), 'collapsed' - стеки для флеймграфа
+PROFILING_FORMAT = os.getenv('PROFILING_FORMAT', 'prof')
+PROFILING_DIR = BASE_DIR / 'profiles'
+# Сколько последних профилей хранить
+PROFILING_KEEP = 50
+
+# Сколько секунд страницы-визитки (главная, контакты, услуги) хранятся в кеше для анонимов; 0 - не кешировать
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Письма уходят по SMTP; при DEBUG пишутся файлами в EMAIL_FILE_PATH (тесты Django подменяют
+# отправку сами). EMAIL_BACKEND из окружения переопределяет оба варианта
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.filebased.EmailBackend' if DEBUG
+                          else 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS') == '1'
+DEFAULT_FROM_EMAIL = 'Медик <noreply@medic.local>'
+
+# За сколько часов до начала приёма пациенту приходит напоминание (команда send_reminders)
+REMINDER_HOURS = 24
@@ -14,26 +14,26 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from hospital import settings
 from hospital_app import views
+from hospital_app.admin import profile_urls
 from hospital_app.views import page_not_found
 
 urlpatterns = [
+    path('admin/profiles/', include(profile_urls)),
     path('admin/', admin.site.urls),
     path('', include('hospital_app.urls')),
     path('users/', include('users.urls', namespace="users")),
+    # Медиа отдаются после проверки доступа; сам файл передаёт nginx/Apache (MEDIA_SENDFILE) или Django
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), views.MediaView.as_view(), name='media'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
     # path('__debug__/', include('debug_toolbar.urls')),
 ]
 
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-
 handler404 = page_not_found
 
 admin.site.site_header = "Панель администрирования"
@@ -1,47 +1,241 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.contrib import admin
-from hospital_app.models import Appointment
+from django.contrib.admin import helpers
+from django.http import FileResponse, Http404, HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from hospital_app import bulk
+from hospital_app.booking import book, is_slot_aligned, SlotConflict
+from hospital_app.forms import BatchCloseForm, BatchReassignForm, BatchShiftForm
+from hospital_app.models import Appointment, Job, SLOT_MINUTES, slot_for
+from hospital_app.pagination import EstimatedCountPaginator
+from hospital_app.profiling import list_profiles, profile_path
 from django.contrib import messages
-from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django import forms
+from users.roles import has_role, DOCTOR, PATIENT
+
+
+# Занятый слот глазами администратора: пациент или доктор (см. SlotConflict.party)
+CONFLICT_MESSAGES = {
+    'patient': 'У пациента уже есть приём в это время.',
+    'doctor': 'В это время у доктора уже есть приём.',
+}
 
 
 class AppointmentAdminForm(forms.ModelForm):
+    # Доктор и пациент выбираются автодополнением; роль проверяется только у выбранного
     class Meta:
         model = Appointment
         fields = '__all__'
 
-    doctor = forms.ModelChoiceField(
-        queryset=get_user_model().objects.filter(groups__name='Doctors'),
-        label='Доктор'
-    )
-    patient = forms.ModelChoiceField(
-        queryset=get_user_model().objects.filter(groups__name='Patient'),
-        label='Пациент'
-    )
+    def clean_doctor(self):
+        doctor = self.cleaned_data['doctor']
+        if not has_role(doctor, DOCTOR):
+            raise ValidationError('Выбранный пользователь не доктор.')
+        return doctor
+
+    def clean_patient(self):
+        patient = self.cleaned_data['patient']
+        if not has_role(patient, PATIENT):
+            raise ValidationError('Выбранный пользователь не пациент.')
+        return patient
+
+    def clean_start_date_time(self):
+        start_date_time = self.cleaned_data['start_date_time']
+        # Те же правила, что при записи пациентом: только начало слота расписания
+        if not is_slot_aligned(start_date_time):
+            raise ValidationError(f'Время приёма должно быть кратно {SLOT_MINUTES} минутам.')
+        return start_date_time
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Занятый слот проверяется здесь, чтобы форма показала ошибку, а не пыталась сохранить приём
+        start_date_time = cleaned_data.get('start_date_time')
+        doctor, patient = cleaned_data.get('doctor'), cleaned_data.get('patient')
+        status = cleaned_data.get('status', self.instance.status)
+        if start_date_time is None or doctor is None or patient is None or status == Appointment.Status.CANCELLED:
+            return cleaned_data
+        taken = Appointment.objects.filter(Q(doctor=doctor) | Q(patient=patient), slot=slot_for(start_date_time))
+        if self.instance.pk:
+            taken = taken.exclude(pk=self.instance.pk)
+        taken_by = list(taken.values_list('patient_id', flat=True))
+        if patient.pk in taken_by:
+            raise ValidationError(CONFLICT_MESSAGES['patient'])
+        if taken_by:
+            raise ValidationError(CONFLICT_MESSAGES['doctor'])
+        return cleaned_data
+
+
+class UserInputFilter(admin.SimpleListFilter):
+    # Фильтр по пользователю без списка всех пользователей в боковой панели:
+    # число - id, иначе начало фамилии
+    template = 'admin/hospital_app/input_filter.html'
+    field_name = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'Все',
+            'params': [(key, value) for key, value in changelist.params.items() if key != self.parameter_name],
+        }
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(**{f'{self.field_name}_id': int(value)})
+        return queryset.filter(**{f'{self.field_name}__last_name__istartswith': value})
+
+
+class DoctorFilter(UserInputFilter):
+    title = 'доктору'
+    parameter_name = 'doctor'
+    field_name = 'doctor'
+
+
+class PatientFilter(UserInputFilter):
+    title = 'пациенту'
+    parameter_name = 'patient'
+    field_name = 'patient'
 
 
 class AppointmentAdmin(admin.ModelAdmin):
     form = AppointmentAdminForm
-    fields = ['doctor', 'patient', 'start_date_time', 'end_date_time', 'complaint', 'readings']
+    fields = ['doctor', 'patient', 'start_date_time', 'end_date_time', 'complaint', 'readings', 'status']
     readonly_fields = ['end_date_time']
-    list_display = ['patient', 'doctor', 'start_date_time', 'end_date_time', 'complaint', 'readings']
+    autocomplete_fields = ['doctor', 'patient']
+    list_display = ['patient', 'doctor', 'start_date_time', 'end_date_time', 'status', 'complaint', 'readings']
+    # Пользователи в списке берутся тем же запросом, что и приёмы
+    list_select_related = ['doctor', 'patient']
+    # По start_date_time есть индекс (appt_reminder_idx начинается с него)
+    date_hierarchy = 'start_date_time'
+    # Без COUNT(*) по всей таблице рядом с результатом фильтра; для всего списка - оценка
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     list_display_links = ('patient', 'doctor',)
-    list_filter = ['patient', 'doctor']
+    list_filter = ['status', DoctorFilter, PatientFilter]
+
+    actions = ['shift_appointments', 'reassign_appointments', 'close_appointments', 'cancel_appointments']
+
+    def batch_action(self, request, queryset, form_class, title, change):
+        # Действие с параметрами: сначала страница с формой, затем пачка меняется одной транзакцией
+        # (см. hospital_app.bulk). change(cleaned_data) возвращает функцию и её аргументы.
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            self.run_batch(request, queryset, *change(form.cleaned_data))
+            return None
+        return TemplateResponse(request, 'admin/hospital_app/appointment_batch.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'form': form,
+            'opts': self.model._meta,
+            'action': request.POST['action'],
+            'selected': queryset.values_list('pk', flat=True),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    def run_batch(self, request, queryset, change, *args):
+        try:
+            count = bulk.apply_batch(queryset, change, *args)
+        except bulk.BatchConflict as e:
+            for appointment, message in e.conflicts:
+                messages.error(request, f'Приём #{appointment.pk} ({appointment.start_date_time:%d-%m-%Y %H:%M}): '
+                                        f'{message}')
+            messages.error(request, 'Ни один приём не изменён.')
+        else:
+            messages.success(request, f'Изменено приёмов: {count}')
+
+    @admin.action(description='Перенести выбранные приёмы')
+    def shift_appointments(self, request, queryset):
+        return self.batch_action(request, queryset, BatchShiftForm, 'Перенос приёмов', lambda data: (
+            bulk.shift, timedelta(days=data['days'] or 0, minutes=data['minutes'] or 0)))
+
+    @admin.action(description='Передать выбранные приёмы другому доктору')
+    def reassign_appointments(self, request, queryset):
+        return self.batch_action(request, queryset, BatchReassignForm, 'Смена доктора', lambda data: (
+            bulk.reassign, data['doctor']))
+
+    @admin.action(description='Закрыть выбранные приёмы ответом')
+    def close_appointments(self, request, queryset):
+        return self.batch_action(request, queryset, BatchCloseForm, 'Ответ на приёмы', lambda data: (
+            bulk.close, data['readings']))
+
+    @admin.action(description='Отменить выбранные приёмы')
+    def cancel_appointments(self, request, queryset):
+        self.run_batch(request, queryset, bulk.cancel)
 
     def get_readonly_fields(self, request, obj=None):
         # Если пользователь является доктором, то поле complaint становится только для чтения
-        if request.user.groups.filter(name='Doctors').exists():
+        if has_role(request.user, DOCTOR):
             return ['complaint']
         return self.readonly_fields
 
-    def save_model(self, request, obj, form, change):
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        # Слот могли занять между проверкой формы и сохранением: транзакция формы откатывается,
+        # а занятый слот показывается сообщением над той же формой вместо ошибки 500
         try:
-            obj.save()
-        except ValidationError as e:
-            for message in e.messages:
-                messages.error(request, message)
-            return
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except SlotConflict as conflict:
+            messages.error(request, CONFLICT_MESSAGES[conflict.party])
+            return HttpResponseRedirect(request.get_full_path())
+
+    def save_model(self, request, obj, form, change):
+        book(obj)
 
 
 admin.site.register(Appointment, AppointmentAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    # Очередь фоновых задач: мёртвые задачи разбираются здесь и возвращаются в работу действием
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['attempts', 'locked_at', 'last_error', 'created_at', 'finished_at']
+    actions = ['requeue']
+
+    @admin.action(description='Поставить в очередь заново')
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status=Job.Status.RUNNING).update(
+            status=Job.Status.QUEUED, attempts=0, run_at=timezone.now(), locked_at=None, finished_at=None
+        )
+        messages.success(request, f'В очередь возвращено задач: {count}')
+
+
+admin.site.register(Job, JobAdmin)
+
+
+# Профили запросов (hospital_app.profiling) - отдельные страницы админки, без модели
+def profiles_view(request):
+    return TemplateResponse(request, 'admin/hospital_app/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Профили запросов',
+        'profiles': list_profiles(),
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+        'header': settings.PROFILING_HEADER,
+    })
+
+
+def profile_download(request, name):
+    profile = profile_path(name)
+    if profile is None:
+        raise Http404
+    return FileResponse(open(profile, 'rb'), as_attachment=True, filename=name)
+
+
+profile_urls = [
+    path('', admin.site.admin_view(profiles_view), name='admin_profiles'),
+    path('<str:name>', admin.site.admin_view(profile_download), name='admin_profile_download'),
+]
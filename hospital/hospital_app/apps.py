@@ -8,6 +8,18 @@ class HospitalAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hospital_app'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import notifications  # noqa: F401
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_recorder
+
+        # Учёт запросов к БД для /metrics: на новых соединениях и на уже открытых
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
     #
     # def ready(self):
     #     self.create_default_groups()
@@ -0,0 +1,133 @@
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .booking import SLOT_DURATION
+from .caching import aget_version, get_version, bump_version
+from .models import Appointment
+
+# Часы приёма клиники (в часовом поясе TIME_ZONE)
+CLINIC_OPENS = time(9)
+CLINIC_CLOSES = time(18)
+# Максимальный запрашиваемый период, дней
+MAX_RANGE_DAYS = 31
+
+AVAILABILITY_CACHE_TIMEOUT = 60
+VERSION_KEY = 'availability:version'
+
+
+def is_working_time(start_date_time):
+    # Приём целиком укладывается в часы работы клиники
+    local = timezone.localtime(start_date_time)
+    opens = local.replace(hour=CLINIC_OPENS.hour, minute=CLINIC_OPENS.minute, second=0, microsecond=0)
+    closes = local.replace(hour=CLINIC_CLOSES.hour, minute=CLINIC_CLOSES.minute, second=0, microsecond=0)
+    return opens <= local and local + SLOT_DURATION <= closes
+
+
+def merge_intervals(intervals):
+    # intervals отсортированы по началу; пересекающиеся и смежные интервалы склеиваются
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def working_slots(date_from, date_to):
+    # Все слоты часов приёма с date_from по date_to включительно
+    day = date_from
+    while day <= date_to:
+        start = timezone.make_aware(datetime.combine(day, CLINIC_OPENS))
+        closes = timezone.make_aware(datetime.combine(day, CLINIC_CLOSES))
+        while start + SLOT_DURATION <= closes:
+            yield start
+            start += SLOT_DURATION
+        day += timedelta(days=1)
+
+
+def free_slots(booked, date_from, date_to, now=None):
+    # Проход двумя указателями по слотам и склеенным занятым интервалам
+    now = now or timezone.now()
+    merged = merge_intervals(booked)
+    result = []
+    i = 0
+    for start in working_slots(date_from, date_to):
+        if start < now:
+            continue
+        end = start + SLOT_DURATION
+        while i < len(merged) and merged[i][1] <= start:
+            i += 1
+        if i == len(merged) or merged[i][0] >= end:
+            result.append(start)
+    return result
+
+
+def booked_queryset(doctor_ids, date_from, date_to):
+    # Один запрос по индексу (doctor, start_date_time) за весь период для всех докторов
+    period_start = timezone.make_aware(datetime.combine(date_from, time.min))
+    period_end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+    return Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        start_date_time__lt=period_end,
+        end_date_time__gt=period_start,
+    ).exclude(
+        status=Appointment.Status.CANCELLED
+    ).order_by('doctor_id', 'start_date_time').values_list('doctor_id', 'start_date_time', 'end_date_time')
+
+
+def group_intervals(doctor_ids, rows):
+    intervals = {doctor_id: [] for doctor_id in doctor_ids}
+    for doctor_id, start, end in rows:
+        intervals[doctor_id].append((start, end))
+    return intervals
+
+
+def booked_intervals(doctor_ids, date_from, date_to):
+    return group_intervals(doctor_ids, booked_queryset(doctor_ids, date_from, date_to))
+
+
+async def abooked_intervals(doctor_ids, date_from, date_to):
+    rows = [row async for row in booked_queryset(doctor_ids, date_from, date_to)]
+    return group_intervals(doctor_ids, rows)
+
+
+def availability_key(version, doctor_ids, date_from, date_to):
+    # Список докторов хешируется: длина ключа не растёт с их числом (memcached - до 250 символов)
+    ids = hashlib.sha1(','.join(str(doctor_id) for doctor_id in sorted(set(doctor_ids))).encode()).hexdigest()
+    return f'availability:{version}:{ids}:{date_from}:{date_to}'
+
+
+def get_availability(doctor_ids, date_from, date_to):
+    # {doctor_id: [начала свободных слотов]} с коротким кешем, сбрасываемым при изменении приёмов
+    key = availability_key(get_version(VERSION_KEY), doctor_ids, date_from, date_to)
+    result = cache.get(key)
+    if result is None:
+        intervals = booked_intervals(doctor_ids, date_from, date_to)
+        result = {
+            doctor_id: free_slots(booked, date_from, date_to)
+            for doctor_id, booked in intervals.items()
+        }
+        cache.set(key, result, AVAILABILITY_CACHE_TIMEOUT)
+    return result
+
+
+async def aget_availability(doctor_ids, date_from, date_to):
+    key = availability_key(await aget_version(VERSION_KEY), doctor_ids, date_from, date_to)
+    result = await cache.aget(key)
+    if result is None:
+        intervals = await abooked_intervals(doctor_ids, date_from, date_to)
+        result = {
+            doctor_id: free_slots(booked, date_from, date_to)
+            for doctor_id, booked in intervals.items()
+        }
+        await cache.aset(key, result, AVAILABILITY_CACHE_TIMEOUT)
+    return result
+
+
+def invalidate_availability():
+    bump_version(VERSION_KEY)
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+
+from .models import Appointment, SLOT_MINUTES
+
+SLOT_DURATION = timedelta(minutes=SLOT_MINUTES)
+
+
+class SlotConflict(Exception):
+    # party - чей слот уже занят: 'patient' или 'doctor'
+    messages = {
+        'patient': 'У вас есть запись в это время.',
+        'doctor': 'В это время у доктора уже есть приём, выбирете другое время.',
+    }
+
+    def __init__(self, party):
+        self.party = party
+        super().__init__(self.messages[party])
+
+
+def slot_start(slot):
+    # Обратное преобразование: номер слота -> время начала приёма (UTC)
+    return datetime.fromtimestamp(slot * SLOT_MINUTES * 60, tz=dt_timezone.utc)
+
+
+def is_slot_aligned(value):
+    return value.second == 0 and value.microsecond == 0 and value.minute % SLOT_MINUTES == 0
+
+
+def book(appointment):
+    # Конфликт определяется одной вставкой: уникальные индексы (doctor, slot) и (patient, slot)
+    # не дадут двум параллельным запросам занять один и тот же слот.
+    try:
+        with transaction.atomic():
+            appointment.save()
+    except IntegrityError:
+        raise SlotConflict(_conflicting_party(appointment))
+    return appointment
+
+
+def _conflicting_party(appointment):
+    # Выполняется только при неудачной вставке - чтобы показать пользователю понятное сообщение
+    taken_by_patient = Appointment.objects.filter(
+        patient_id=appointment.patient_id, slot=appointment.slot
+    ).exists()
+    return 'patient' if taken_by_patient else 'doctor'
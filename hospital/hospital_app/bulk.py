@@ -0,0 +1,112 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .availability import invalidate_availability, merge_intervals
+from .booking import SlotConflict
+from .models import Appointment, conclusion_preview, slot_for
+from .recurring import overlaps
+from .signals import notify_doctors
+
+# Поля, которые меняют массовые операции; bulk_update пишет только их
+BULK_FIELDS = ['doctor', 'start_date_time', 'end_date_time', 'slot', 'status', 'readings', 'readings_preview',
+               'reminder_sent_at']
+
+
+class BatchConflict(Exception):
+    # conflicts - пары (приём, сообщение); ни один приём пачки не изменён
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__('; '.join(f'{appointment.pk}: {message}' for appointment, message in conflicts))
+
+
+def shift(appointment, delta):
+    appointment.start_date_time += delta
+    appointment.end_date_time += delta
+    appointment.slot = slot_for(appointment.start_date_time)
+
+
+def reassign(appointment, doctor):
+    appointment.doctor = doctor
+
+
+def close(appointment, readings):
+    appointment.readings = readings
+    appointment.readings_preview = conclusion_preview(readings)
+    appointment.status = Appointment.Status.ANSWERED
+
+
+def cancel(appointment):
+    appointment.status = Appointment.Status.CANCELLED
+    appointment.slot = None
+
+
+def find_conflicts(appointments):
+    # Один запрос по диапазону: занятое время всех затронутых докторов и пациентов,
+    # кроме самих приёмов пачки - их прежнее время освобождается
+    active = [a for a in appointments if a.status != Appointment.Status.CANCELLED]
+    if not active:
+        return []
+    doctor_ids = {a.doctor_id for a in active}
+    patient_ids = {a.patient_id for a in active}
+    rows = Appointment.objects.filter(
+        Q(doctor_id__in=doctor_ids) | Q(patient_id__in=patient_ids),
+        start_date_time__lt=max(a.end_date_time for a in active),
+        end_date_time__gt=min(a.start_date_time for a in active),
+    ).exclude(
+        status=Appointment.Status.CANCELLED
+    ).exclude(
+        pk__in=[a.pk for a in appointments]
+    ).order_by('start_date_time').values_list('doctor_id', 'patient_id', 'start_date_time', 'end_date_time')
+
+    busy = {}
+    for doctor_id, patient_id, start, end in rows:
+        busy.setdefault(('doctor', doctor_id), []).append((start, end))
+        busy.setdefault(('patient', patient_id), []).append((start, end))
+    busy = {key: merge_intervals(intervals) for key, intervals in busy.items()}
+
+    conflicts = []
+    taken = set()
+    for appointment in sorted(active, key=lambda a: a.start_date_time):
+        start, end = appointment.start_date_time, appointment.end_date_time
+        for party, user_id in (('patient', appointment.patient_id), ('doctor', appointment.doctor_id)):
+            # Занято другим приёмом или приёмом этой же пачки, уже поставленным на этот слот
+            if overlaps(busy.get((party, user_id), []), start, end) or (party, user_id, appointment.slot) in taken:
+                conflicts.append((appointment, SlotConflict.messages[party]))
+                break
+        else:
+            taken.add(('patient', appointment.patient_id, appointment.slot))
+            taken.add(('doctor', appointment.doctor_id, appointment.slot))
+    return conflicts
+
+
+def apply_batch(queryset, change, *args):
+    # Меняет все приёмы queryset функцией change(приём, *args) одной транзакцией.
+    # При любом конфликте пачка не сохраняется (BatchConflict). Возвращает число приёмов.
+    ids = list(queryset.values_list('pk', flat=True))
+    with transaction.atomic():
+        appointments = list(Appointment.objects.filter(pk__in=ids).select_for_update().order_by('pk'))
+        if not appointments:
+            return 0
+        old_doctors = {a.pk: a.doctor_id for a in appointments}
+        for appointment in appointments:
+            start = appointment.start_date_time
+            change(appointment, *args)
+            # bulk_update минует save(): о перенесённом приёме напоминание сбрасывается здесь
+            if appointment.start_date_time != start:
+                appointment.reminder_sent_at = None
+
+        conflicts = find_conflicts(appointments)
+        if conflicts:
+            raise BatchConflict(conflicts)
+
+        # Уникальность (doctor, slot) проверяется построчно: при сдвиге подряд идущих приёмов
+        # новый слот одного совпал бы со старым слотом соседа. Сначала слоты освобождаются.
+        Appointment.objects.filter(pk__in=old_doctors).update(slot=None)
+        Appointment.objects.bulk_update(appointments, BULK_FIELDS, batch_size=500)
+
+        # bulk_update и update() не вызывают save() и сигналы
+        invalidate_availability()
+        changes = {(a.pk, a.doctor_id) for a in appointments}
+        changes.update(old_doctors.items())
+        notify_doctors(sorted(changes))
+    return len(appointments)
@@ -0,0 +1,62 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+
+def new_version():
+    # Метка времени, а не счётчик: если ключ версии истёк или вытеснен из кеша, новая версия
+    # не совпадёт ни с одной прежней и не вернёт устаревшие записи
+    return time.time_ns()
+
+
+def get_version(key):
+    # Номер поколения кеша; смена делает недействительными все ключи, построенные на нём
+    return cache.get_or_set(key, new_version, None)
+
+
+async def aget_version(key):
+    return await cache.aget_or_set(key, new_version, None)
+
+
+def bump_version(key):
+    cache.set(key, new_version(), None)
+
+
+class CachedPageMixin:
+    # Страница без данных пользователя: анонимам отдаётся из кеша без шаблонизатора,
+    # всем - с ETag (и Last-Modified для анонимов), чтобы повторный визит получил 304
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        anonymous = not request.user.is_authenticated
+        timeout = settings.PAGE_CACHE_TIMEOUT if anonymous else 0
+        # Параметры запроса на эти страницы не влияют и в ключ не входят
+        key = f'page:{request.path}'
+        entry = cache.get(key) if timeout else None
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            entry = (response.content, quote_etag(hashlib.md5(response.content).hexdigest()), int(time.time()))
+            if timeout:
+                cache.set(key, entry, timeout)
+
+        content, etag, last_modified = entry
+        if not anonymous:
+            # Шапка зависит от пользователя - дата кеша анонимов к ней не относится
+            last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(content)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
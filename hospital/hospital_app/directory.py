@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from users.thumbnails import PhotoSources
+
+from .caching import aget_version, get_version, bump_version
+
+DIRECTORY_CACHE_TIMEOUT = 60 * 60
+VERSION_KEY = 'doctors:directory:version'
+
+
+@dataclass(frozen=True)
+class DoctorEntry:
+    id: int
+    first_name: str
+    last_name: str
+    cat_doctor: str
+    photo_url: str
+    # Миниатюры для srcset; None - фото нет или миниатюры ещё не созданы
+    photo_sources: PhotoSources = None
+
+    @property
+    def label(self):
+        return f'{self.cat_doctor} {self.first_name} {self.last_name}'
+
+
+def doctors_queryset():
+    return get_user_model().objects.filter(groups__name='Doctors').only(
+        'id', 'first_name', 'last_name', 'cat_doctor', 'photo', 'has_thumbnails'
+    ).order_by('id')
+
+
+def doctor_entry(doctor):
+    return DoctorEntry(
+        id=doctor.pk,
+        first_name=doctor.first_name,
+        last_name=doctor.last_name,
+        cat_doctor=doctor.cat_doctor or '',
+        photo_url=doctor.photo.url if doctor.photo else '',
+        photo_sources=doctor.photo_sources,
+    )
+
+
+def load_doctors():
+    return [doctor_entry(doctor) for doctor in doctors_queryset()]
+
+
+async def aload_doctors():
+    return [doctor_entry(doctor) async for doctor in doctors_queryset().aiterator()]
+
+
+def get_doctors():
+    # Справочник докторов редко меняется, а читается почти на каждой странице пациента
+    key = f'doctors:directory:{get_version(VERSION_KEY)}'
+    doctors = cache.get(key)
+    if doctors is None:
+        doctors = load_doctors()
+        cache.set(key, doctors, DIRECTORY_CACHE_TIMEOUT)
+    return doctors
+
+
+async def aget_doctors():
+    key = f'doctors:directory:{await aget_version(VERSION_KEY)}'
+    doctors = await cache.aget(key)
+    if doctors is None:
+        doctors = await aload_doctors()
+        await cache.aset(key, doctors, DIRECTORY_CACHE_TIMEOUT)
+    return doctors
+
+
+def get_doctor_photos():
+    # Имена фото докторов: они открыты всем, как и страница персонала
+    key = f'doctors:photos:{get_version(VERSION_KEY)}'
+    photos = cache.get(key)
+    if photos is None:
+        photos = frozenset(get_user_model().objects.filter(groups__name='Doctors').exclude(photo='').exclude(
+            photo__isnull=True).values_list('photo', flat=True))
+        cache.set(key, photos, DIRECTORY_CACHE_TIMEOUT)
+    return photos
+
+
+def invalidate_doctors():
+    bump_version(VERSION_KEY)
+
+
+# Поисковый индекс живёт в памяти процесса и пересобирается при смене версии справочника
+_search_index = (None, [], [])
+
+
+def tokens(doctor):
+    return [word.lower() for word in (doctor.first_name, doctor.last_name, *doctor.cat_doctor.split()) if word]
+
+
+def get_search_index():
+    global _search_index
+    version = get_version(VERSION_KEY)
+    if _search_index[0] != version:
+        doctors = get_doctors()
+        # Отсортированные пары (слово, позиция доктора) - поиск по префиксу через bisect
+        keys = sorted((word, position) for position, doctor in enumerate(doctors) for word in tokens(doctor))
+        _search_index = (version, doctors, keys)
+    return _search_index[1], _search_index[2]
+
+
+def search_doctors(query, limit=10):
+    # Префиксный поиск по имени, фамилии и категории; все слова запроса должны совпасть
+    doctors, keys = get_search_index()
+    words = query.lower().split()
+    if not words:
+        return doctors[:limit]
+
+    first, rest = words[0], words[1:]
+    found = []
+    seen = set()
+    i = bisect_left(keys, (first,))
+    while i < len(keys) and keys[i][0].startswith(first) and len(found) < limit:
+        position = keys[i][1]
+        i += 1
+        if position in seen:
+            continue
+        seen.add(position)
+        doctor_tokens = tokens(doctors[position])
+        if all(any(token.startswith(word) for token in doctor_tokens) for word in rest):
+            found.append(doctors[position])
+    return found
+
+
+def get_doctor(doctor_id):
+    return next((doctor for doctor in get_doctors() if doctor.id == doctor_id), None)
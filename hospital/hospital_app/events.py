@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+
+from django.http import StreamingHttpResponse
+
+# Пустой комментарий раз в HEARTBEAT_SECONDS не даёт прокси закрыть молчащее соединение
+HEARTBEAT_SECONDS = 15
+# Поток событий живёт не дольше STREAM_SECONDS, после чего EventSource переподключается сам
+STREAM_SECONDS = 300
+# Сколько событий ждёт медленного клиента; при переполнении ему отправляется reset
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.lost = False
+
+    def put(self, event):
+        # Выполняется в цикле событий подписчика
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lost = True
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    # Подписчики одного воркера: канал -> открытые SSE-соединения.
+    # Публиковать можно из любого потока, доставка идёт через цикл событий подписчика.
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def subscribers(self, channel):
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+    def deliver(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт - соединение умерло, не отписавшись
+                self.unsubscribe(subscription)
+
+
+class LocalFanout:
+    # Замена внешнего pub/sub (Redis и т.п.) для нескольких воркеров: событие публикуется
+    # один раз и доставляется брокеру каждого подключённого воркера. В одном процессе
+    # подключён один брокер; тесты подключают несколько, изображая соседние воркеры.
+    def __init__(self):
+        self.brokers = []
+        self._ids = itertools.count(1)
+
+    def attach(self, broker):
+        self.brokers.append(broker)
+        return broker
+
+    def detach(self, broker):
+        self.brokers.remove(broker)
+
+    def subscribers(self, channel):
+        # Без подписчиков событие можно не готовить вовсе
+        return sum(broker.subscribers(channel) for broker in self.brokers)
+
+    def publish(self, channel, name, data):
+        event = (next(self._ids), name, data)
+        for broker in list(self.brokers):
+            broker.deliver(channel, event)
+
+
+fanout = LocalFanout()
+broker = fanout.attach(Broker())
+
+
+def publish(channel, name, data):
+    fanout.publish(channel, name, data)
+
+
+def doctor_channel(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+def format_event(event):
+    event_id, name, data = event
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def event_stream(subscription, heartbeat=HEARTBEAT_SECONDS, duration=STREAM_SECONDS):
+    # Строки text/event-stream до истечения duration
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    try:
+        yield f'retry: {heartbeat * 1000}\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await subscription.get(min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_event(event)
+            if subscription.lost:
+                # Часть событий не поместилась в очередь - клиенту нужно перечитать страницу
+                yield 'event: reset\ndata: {}\n\n'
+                break
+    finally:
+        subscription.broker.unsubscribe(subscription)
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    # Сервер закрывает ответ и при обрыве соединения - тогда же снимается подписка,
+    # не дожидаясь, пока сборщик мусора закроет генератор
+    def __init__(self, subscription, **kwargs):
+        super().__init__(event_stream(subscription), content_type='text/event-stream', **kwargs)
+        self.subscription = subscription
+        self['Cache-Control'] = 'no-cache'
+        self['X-Accel-Buffering'] = 'no'
+
+    def close(self):
+        self.subscription.broker.unsubscribe(self.subscription)
+        super().close()
@@ -0,0 +1,79 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Appointment
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Колонки выгрузки: заголовок -> поле (с данными доктора и пациента через JOIN)
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('start_date_time', 'start_date_time'),
+    ('end_date_time', 'end_date_time'),
+    ('status', 'status'),
+    ('doctor_id', 'doctor_id'),
+    ('doctor_first_name', 'doctor__first_name'),
+    ('doctor_last_name', 'doctor__last_name'),
+    ('doctor_category', 'doctor__cat_doctor'),
+    ('patient_id', 'patient_id'),
+    ('patient_first_name', 'patient__first_name'),
+    ('patient_last_name', 'patient__last_name'),
+    ('complaint', 'complaint'),
+    ('readings', 'readings'),
+]
+HEADERS = [header for header, _ in EXPORT_COLUMNS]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def export_queryset(doctor_id=None, date_from=None, date_to=None):
+    # Приёмы доктора (или всех) с date_from по date_to включительно
+    queryset = Appointment.objects.all()
+    if doctor_id is not None:
+        queryset = queryset.filter(doctor_id=doctor_id)
+    if date_from is not None:
+        queryset = queryset.filter(start_date_time__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to is not None:
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        queryset = queryset.filter(start_date_time__lt=end)
+    return queryset.order_by('start_date_time', 'id')
+
+
+def export_rows(queryset):
+    # Строки читаются с сервера БД пачками: в памяти не больше EXPORT_CHUNK_SIZE записей
+    values = queryset.values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+    return values.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class Echo:
+    # csv.writer пишет в объект с методом write - возвращаем строку, чтобы отдать её дальше
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADERS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADERS, row)), ensure_ascii=False, default=str) + '\n'
+
+
+FORMATS = {
+    'csv': csv_lines,
+    'jsonl': jsonl_lines,
+}
+
+
+def export_lines(queryset, export_format):
+    return FORMATS[export_format](export_rows(queryset))
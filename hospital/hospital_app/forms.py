@@ -1,25 +1,47 @@
 from collections import OrderedDict
 from django.contrib.auth import get_user_model
 from django.forms import DateTimeInput
+from django.urls import reverse
 from django import forms
-from .models import Appointment
+from .availability import is_working_time
+from .booking import is_slot_aligned
+from .directory import get_doctor
+from .models import Appointment, RussianLettersValidator, SLOT_MINUTES
+from .recurring import MAX_OCCURRENCES, expand_rule
+from users.roles import DOCTOR
 
 
 
-class DoctorModelChoiceField(forms.ModelChoiceField):
-    def label_from_instance(self, obj):
-        return f'{obj.cat_doctor} {obj.first_name} {obj.last_name}'
+class DoctorPickerWidget(forms.Widget):
+    # Скрытое поле с id доктора и строка поиска с подсказками вместо списка всех докторов
+    template_name = 'hospital_app/widgets/doctor_picker.html'
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        doctor = get_doctor(int(value)) if str(value or '').isdigit() else None
+        context['widget']['label'] = doctor.label if doctor else ''
+        context['widget']['search_url'] = reverse('doctors_search')
+        return context
+
+    def id_for_label(self, id_):
+        return f'{id_}_search' if id_ else id_
+
+
+class DoctorChoiceField(forms.ModelChoiceField):
+    # Подсказки берутся из кешированного справочника, но выбор проверяется запросом к БД:
+    # пользователь с отозванной ролью доктора не пройдёт, даже пока справочник в кеше
+    def __init__(self, **kwargs):
+        super().__init__(queryset=get_user_model().objects.filter(groups__name=DOCTOR), **kwargs)
 
 
 class PatientNewAppointmentForm(forms.ModelForm):
-    doctor = DoctorModelChoiceField(
-        queryset=get_user_model().objects.filter(groups__name='Doctors'),
+    doctor = DoctorChoiceField(
         label='Доктор',
-        widget=forms.RadioSelect(attrs={'class': 'form-input-select'})
+        widget=DoctorPickerWidget(),
     )
 
     start_date_time = forms.DateTimeField(
-        widget=DateTimeInput(attrs={'type': 'datetime-local', 'class': 'form-input'}),
+        widget=DateTimeInput(attrs={'type': 'datetime-local', 'class': 'form-input', 'step': SLOT_MINUTES * 60}),
         label='Дата приёма'
     )
 
@@ -28,42 +50,89 @@ class PatientNewAppointmentForm(forms.ModelForm):
         label='Жалобы'
     )
 
-    patient = forms.ModelChoiceField(
-        queryset=get_user_model().objects.filter(groups__name='Patient'),
-        label='Пациент',
-        widget=forms.HiddenInput(),  # Используем HiddenInput, чтобы поле было скрытым на странице
-    )
-
     patient_name = forms.CharField(
         label='Пациент',
+        required=False,
         widget=forms.TextInput(attrs={'readonly': True, 'class': 'form-input'})
     )
 
     class Meta:
         model = Appointment
-        fields = ['patient', 'doctor', 'start_date_time', 'complaint']
+        fields = ['doctor', 'start_date_time', 'complaint']
 
     def __init__(self, *args, **kwargs):
         # Добавляем параметр request в конструктор формы
         self.request = kwargs.pop('request', None)
         super().__init__(*args, **kwargs)
 
-        # Если пользователь аутентифицирован, устанавливаем его как пациента
+        # Если пользователь аутентифицирован, устанавливаем его как пациента (без поля формы и запроса)
         if self.request and self.request.user.is_authenticated:
-            self.fields['patient'].initial = self.request.user
+            self.instance.patient = self.request.user
             self.fields['patient_name'].initial = f"{self.request.user.first_name} {self.request.user.last_name}"
 
         # Делаем поле "пациент" только для чтения
         self.fields['patient_name'].widget.attrs['readonly'] = True
         self.fields['patient_name'].disabled = True
 
-        # Стилизуем выбор доктора
-        self.fields['doctor'].widget.attrs['class'] = 'form-input-select'
-
         # Изменяем порядок полей в форме
         field_order = ['patient_name', 'doctor', 'start_date_time', 'complaint']
         self.fields = OrderedDict((key, self.fields[key]) for key in field_order)
 
+    def clean_start_date_time(self):
+        start_date_time = self.cleaned_data['start_date_time']
+        # Запись возможна только на начало слота расписания
+        if not is_slot_aligned(start_date_time):
+            raise forms.ValidationError(f"Время приёма должно быть кратно {SLOT_MINUTES} минутам.")
+        if not is_working_time(start_date_time):
+            raise forms.ValidationError("Выбранное время вне часов приёма клиники.")
+        return start_date_time
+
+
+class RecurringAppointmentForm(forms.Form):
+    # Серия приёмов: первый приём и правило повтора (каждые interval дней/недель, count раз или до until)
+    doctor = DoctorChoiceField(label='Доктор')
+    start_date_time = forms.DateTimeField(label='Первый приём')
+    frequency = forms.ChoiceField(choices=[('daily', 'Каждый день'), ('weekly', 'Каждую неделю')], label='Повтор')
+    interval = forms.IntegerField(min_value=1, max_value=4, required=False, label='Интервал')
+    count = forms.IntegerField(min_value=1, max_value=MAX_OCCURRENCES, required=False, label='Количество приёмов')
+    until = forms.DateField(required=False, label='Последний день')
+    complaint = forms.CharField(max_length=500, required=False, validators=[RussianLettersValidator()],
+                                label='Жалобы')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('count') and not cleaned_data.get('until'):
+            raise forms.ValidationError('Укажите количество приёмов или последний день серии.')
+        return cleaned_data
+
+    def occurrences(self):
+        data = self.cleaned_data
+        return expand_rule(data['start_date_time'], data['frequency'], data['interval'] or 1,
+                           data['count'], data['until'])
+
+
+class BatchShiftForm(forms.Form):
+    days = forms.IntegerField(initial=0, label='Сдвиг, дней')
+    minutes = forms.IntegerField(initial=0, label='Сдвиг, минут')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        minutes = cleaned_data.get('minutes') or 0
+        if minutes % SLOT_MINUTES:
+            raise forms.ValidationError(f"Сдвиг должен быть кратен {SLOT_MINUTES} минутам.")
+        if not minutes and not cleaned_data.get('days'):
+            raise forms.ValidationError("Укажите сдвиг.")
+        return cleaned_data
+
+
+class BatchReassignForm(forms.Form):
+    doctor = DoctorChoiceField(label='Новый доктор', widget=DoctorPickerWidget())
+
+
+class BatchCloseForm(forms.Form):
+    readings = forms.CharField(widget=forms.Textarea, validators=[RussianLettersValidator()],
+                               label='Ответ доктора')
+
 
 class DoctorAnswerForm(forms.ModelForm):
     class Meta:
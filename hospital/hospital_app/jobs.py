@@ -0,0 +1,101 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором: RETRY_BASE_SECONDS * 2^(попытка-1), не больше RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+# Задача, которая выполняется дольше, считается брошенной упавшим воркером и возвращается в очередь
+LOCK_TIMEOUT = timedelta(minutes=10)
+STALE_ERROR = 'Воркер не завершил задачу: упал или был остановлен'
+
+# Имя задачи -> функция; функции регистрируются декоратором task
+TASKS = {}
+
+
+def task(name):
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, max_attempts=5, **payload):
+    # Задача попадает в очередь только после фиксации транзакции: откаченная запись
+    # не должна порождать письма, а сам запрос не ждёт их отправки
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача {name}')
+    transaction.on_commit(lambda: Job.objects.create(
+        name=name, payload=payload, max_attempts=max_attempts, run_at=timezone.now()
+    ))
+
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    # Небольшой разброс, чтобы упавшие вместе задачи не повторялись тоже вместе
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def requeue_stale(now):
+    # Брошенный запуск считается попыткой: задача, которая роняет воркер (память, таймаут),
+    # иначе возвращалась бы в очередь бесконечно. Исчерпавшая попытки становится мёртвой
+    stale = Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=now - LOCK_TIMEOUT)
+    lost = {'attempts': F('attempts') + 1, 'locked_at': None, 'last_error': STALE_ERROR}
+    dead = stale.filter(attempts__gte=F('max_attempts') - 1).update(status=Job.Status.DEAD, finished_at=now, **lost)
+    if dead:
+        logger.error('Задач брошено воркером и исчерпало попытки: %s', dead)
+    stale.update(status=Job.Status.QUEUED, **lost)
+
+
+def claim(limit):
+    # Забирает до limit готовых задач. Условное UPDATE гарантирует, что задачу
+    # возьмёт один воркер, даже если несколько выбрали одни и те же строки
+    now = timezone.now()
+    requeue_stale(now)
+    with transaction.atomic():
+        candidates = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.QUEUED, run_at__lte=now)
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        claimed = [
+            pk for pk in candidates
+            if Job.objects.filter(pk=pk, status=Job.Status.QUEUED).update(status=Job.Status.RUNNING, locked_at=now)
+        ]
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_at', 'id'))
+
+
+def run_job(job):
+    func = TASKS.get(job.name)
+    job.attempts += 1
+    try:
+        if func is None:
+            raise KeyError(f'Неизвестная задача {job.name}')
+        func(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            # Мёртвая задача остаётся в таблице для разбора и ручного перезапуска
+            job.status = Job.Status.DEAD
+            job.finished_at = timezone.now()
+            logger.error('Задача %s исчерпала попытки', job)
+        else:
+            job.status = Job.Status.QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+            logger.warning('Задача %s упала, повтор в %s', job, job.run_at)
+    else:
+        job.status = Job.Status.DONE
+        job.finished_at = timezone.now()
+    job.locked_at = None
+    job.save(update_fields=['status', 'attempts', 'run_at', 'locked_at', 'last_error', 'finished_at'])
+    return job
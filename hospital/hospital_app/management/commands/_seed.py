@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.utils import timezone
+
+from hospital_app.booking import SLOT_DURATION, slot_start
+from hospital_app.models import Appointment, conclusion_preview, slot_for
+
+# Все пользователи, созданные для замеров, начинаются с этого префикса
+BENCH_PREFIX = 'bench_'
+
+
+def seed_appointments(rows, doctors_count, patients_count, batch_size=5000):
+    User = get_user_model()
+    User.objects.bulk_create(
+        User(username=f'{BENCH_PREFIX}doctor_{i}', first_name='Доктор', last_name=str(i))
+        for i in range(doctors_count)
+    )
+    User.objects.bulk_create(
+        User(username=f'{BENCH_PREFIX}patient_{i}', first_name='Пациент', last_name=str(i))
+        for i in range(patients_count)
+    )
+    # bulk_create не возвращает pk на MySQL - перечитываем пользователей
+    doctors = list(User.objects.filter(username__startswith=f'{BENCH_PREFIX}doctor_').order_by('id'))
+    patients = list(User.objects.filter(username__startswith=f'{BENCH_PREFIX}patient_').order_by('id'))
+    Group.objects.get_or_create(name='Doctors')[0].user_set.add(*doctors)
+    Group.objects.get_or_create(name='Patient')[0].user_set.add(*patients)
+
+    # Каждой записи свой слот - ограничения уникальности слотов не нарушаются
+    first_slot = slot_for(timezone.now()) + 1
+    readings = 'заключение доктора'
+    preview = conclusion_preview(readings)
+    batch = []
+    for i in range(rows):
+        slot = first_slot + i
+        start = slot_start(slot)
+        batch.append(Appointment(
+            doctor=doctors[i % doctors_count],
+            patient=patients[i % patients_count],
+            start_date_time=start,
+            end_date_time=start + SLOT_DURATION,
+            slot=slot,
+            complaint='жалоба',
+            readings='' if i % 5 == 0 else readings,
+            readings_preview='' if i % 5 == 0 else preview,
+            status=Appointment.Status.PENDING if i % 5 == 0 else Appointment.Status.ANSWERED,
+        ))
+        if len(batch) == batch_size:
+            Appointment.objects.bulk_create(batch)
+            batch = []
+    Appointment.objects.bulk_create(batch)
+    return doctors, patients
+
+
+def delete_seed():
+    get_user_model().objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+
+@contextmanager
+def bench_database(keep=False):
+    # Отдельная база test_<NAME>, как у manage.py test, с применёнными миграциями: тестовые строки
+    # и снятые на время замера индексы не попадают в рабочую базу, даже если замер прервали
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keep)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
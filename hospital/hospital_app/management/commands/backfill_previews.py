@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from hospital_app.models import Appointment, conclusion_preview
+
+
+class Command(BaseCommand):
+    help = 'Заполняет сохранённое начало заключения доктора (readings_preview) у существующих приёмов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--force', action='store_true', help='Пересчитать и уже заполненные записи')
+
+    def handle(self, *args, **options):
+        queryset = Appointment.objects.exclude(readings='').only('id', 'readings').order_by('pk')
+        if not options['force']:
+            queryset = queryset.filter(readings_preview='')
+
+        updated = 0
+        last_pk = 0
+        while True:
+            # Пачки по возрастанию pk - каждая следующая начинается с индекса, без OFFSET
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            for appointment in batch:
+                appointment.readings_preview = conclusion_preview(appointment.readings)
+            Appointment.objects.bulk_update(batch, ['readings_preview'])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(f'Обновлено приёмов: {updated}')
@@ -0,0 +1,104 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+
+from hospital_app import views
+from hospital_app.models import Appointment
+from hospital_app.pagination import encode_cursor
+
+from ._seed import bench_database, seed_appointments, delete_seed
+
+# Запросы страниц списков в том виде, в каком их строят сами представления (с курсором keyset)
+BENCH_VIEWS = [
+    (views.PatientNewListView, 'patient'),
+    (views.PatientOldListView, 'patient'),
+    (views.DoctorHistoryListView, 'doctor'),
+    (views.DoctorAllHistoryListView, 'doctor'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Во временной тестовой базе заполняет таблицу приёмов и печатает EXPLAIN и время запросов ' \
+           'списков без индексов Appointment и с ними'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Количество приёмов')
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=10, help='Повторов каждого запроса')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовую базу и данные после замера')
+
+    def handle(self, *args, **options):
+        # Индексы снимаются и заново создаются только в тестовой базе, рабочая не затрагивается
+        with bench_database(keep=options['keep']):
+            delete_seed()
+            self.bench(options)
+
+    def bench(self, options):
+        doctors, patients = seed_appointments(options['rows'], options['doctors'], options['patients'])
+        self.stdout.write(f'Создано приёмов: {options["rows"]}')
+        try:
+            factory = RequestFactory()
+            users = {'doctor': doctors[0], 'patient': patients[0]}
+            indexes = Appointment._meta.indexes
+
+            self.drop_indexes(indexes)
+            try:
+                before = self.measure(factory, users, options['repeat'], 'без индексов')
+            finally:
+                self.create_indexes(indexes)
+            after = self.measure(factory, users, options['repeat'], 'с индексами')
+
+            self.stdout.write('\nИтог (медиана, мс):')
+            for name in before:
+                self.stdout.write(f'  {name:<40} {before[name]:>9.2f} -> {after[name]:>9.2f}')
+        finally:
+            if not options['keep']:
+                delete_seed()
+
+    def measure(self, factory, users, repeat, label):
+        self.stdout.write(f'\n=== {label} ===')
+        results = {}
+        for view_class, role in BENCH_VIEWS:
+            # Первая страница и страница из середины списка: курсор не должен дорожать с глубиной
+            rows = self.make_view(view_class, factory.get('/'), users[role]).get_queryset()
+            pages = [('первая', {})]
+            count = rows.count()
+            if count:
+                pages.append(('середина', {'after': encode_cursor(rows[count // 2])}))
+
+            for page, params in pages:
+                view = self.make_view(view_class, factory.get('/', params), users[role])
+                queryset, _, _ = view.get_page_queryset(view.get_queryset(), view.paginate_by)
+
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    list(queryset.all())
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                name = f'{view_class.__name__} ({page})'
+                results[name] = statistics.median(timings)
+                self.stdout.write(f'\n{name}: {results[name]:.2f} мс')
+                self.stdout.write(queryset.explain())
+        return results
+
+    def make_view(self, view_class, request, user):
+        view = view_class()
+        view.request = request
+        view.request.user = user
+        view.kwargs = {}
+        return view
+
+    def drop_indexes(self, indexes):
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Appointment, index)
+
+    def create_indexes(self, indexes):
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Appointment, index)
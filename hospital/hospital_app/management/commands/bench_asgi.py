@@ -0,0 +1,124 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from ._seed import seed_appointments, delete_seed
+
+# (синхронная страница, её async-вариант)
+PAGES = [
+    ('doctor_history', 'async_doctor_history'),
+    ('doctor_history_all', 'async_doctor_history_all'),
+    ('doctors_all', 'async_doctors_all'),
+]
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность страниц при одновременных запросах: '
+            'WSGI с пулом потоков против ASGI с синхронными и async-представлениями')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Количество приёмов у доктора')
+        parser.add_argument('--requests', type=int, default=400, help='Запросов к каждой странице')
+        parser.add_argument('--concurrency', type=int, default=32, help='Одновременных запросов')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков WSGI-сервера')
+        parser.add_argument('--db-latency', type=float, default=5,
+                            help='Искусственная задержка каждого SQL-запроса, мс (сетевой round trip до MySQL)')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные после замера')
+
+    def handle(self, *args, **options):
+        doctors, _ = seed_appointments(options['rows'], 1, 100)
+        client = Client(HTTP_HOST='127.0.0.1')
+        client.force_login(doctors[0])
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            connection.execute_wrappers.append(delay)
+
+        # Задержка ставится на каждое новое соединение: у каждого потока оно своё
+        connections.close_all()
+        connection_created.connect(add_delay)
+        try:
+            self.compare(options['requests'], options['concurrency'], options['workers'])
+        finally:
+            connection_created.disconnect(add_delay)
+            connections.close_all()
+            if not options['keep']:
+                delete_seed()
+
+    def compare(self, count, concurrency, workers):
+        wsgi = get_wsgi_application()
+        asgi = get_asgi_application()
+
+        self.stdout.write(f'{"страница":<20} {"WSGI":>10} {"ASGI sync":>10} {"ASGI async":>11}  (запросов/с)')
+        for name, async_name in PAGES:
+            sync_url, async_url = reverse(name), reverse(async_name)
+            # Прогрев кешей ролей и справочника, чтобы сравнивались обычные запросы
+            self.wsgi_get(wsgi, sync_url)
+            with ThreadPoolExecutor(workers) as pool:
+                started = time.perf_counter()
+                statuses = list(pool.map(lambda _: self.wsgi_get(wsgi, sync_url), range(count)))
+                wsgi_rate = count / (time.perf_counter() - started)
+            asgi_sync_rate, sync_statuses = asyncio.run(self.asgi_rate(asgi, sync_url, count, concurrency))
+            asgi_async_rate, async_statuses = asyncio.run(self.asgi_rate(asgi, async_url, count, concurrency))
+            if set(statuses + sync_statuses + async_statuses) != {200}:
+                self.stderr.write(f'{name}: неожиданные ответы {set(statuses + sync_statuses + async_statuses)}')
+            self.stdout.write(f'{name:<20} {wsgi_rate:>10.0f} {asgi_sync_rate:>10.0f} {asgi_async_rate:>11.0f}')
+
+    def wsgi_get(self, app, path):
+        environ = {'PATH_INFO': path, 'HTTP_HOST': '127.0.0.1', 'HTTP_COOKIE': self.cookie}
+        setup_testing_defaults(environ)
+        status = []
+        response = app(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        return status[0]
+
+    async def asgi_rate(self, app, path, count, concurrency):
+        # Как uvicorn: один event loop, до concurrency запросов одновременно
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                return await self.asgi_get(app, path)
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(one() for _ in range(count)))
+        return count / (time.perf_counter() - started), list(statuses)
+
+    async def asgi_get(self, app, path):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'127.0.0.1'), (b'cookie', self.cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 80),
+        }
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await app(scope, receive, send)
+        return status[0]
@@ -0,0 +1,36 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+PAGES = ['home', 'contact', 'awards', 'analyzes', 'mrt', 'kt']
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает число запросов в секунду к страницам-визиткам без кеша страниц, с кешем и с условным GET'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Запросов к каждой странице')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        client = Client(HTTP_HOST='127.0.0.1')
+
+        self.stdout.write(f'{"страница":<10} {"без кеша":>10} {"кеш":>10} {"304":>10}  (запросов/с)')
+        for name in PAGES:
+            url = reverse(name)
+            cache.delete(f'page:{url}')
+            with override_settings(PAGE_CACHE_TIMEOUT=0):
+                plain = self.rate(client, url, count)
+            cached = self.rate(client, url, count)
+            etag = client.get(url)['ETag']
+            conditional = self.rate(client, url, count, HTTP_IF_NONE_MATCH=etag)
+            self.stdout.write(f'{name:<10} {plain:>10.0f} {cached:>10.0f} {conditional:>10.0f}')
+
+    def rate(self, client, url, count, **headers):
+        started = time.perf_counter()
+        for _ in range(count):
+            client.get(url, **headers)
+        return count / (time.perf_counter() - started)
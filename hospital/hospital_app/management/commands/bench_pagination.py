@@ -0,0 +1,64 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.test import RequestFactory
+
+from hospital_app.pagination import encode_cursor
+from hospital_app.views import DoctorAllHistoryListView
+
+from ._seed import seed_appointments, delete_seed
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время получения глубоких страниц истории доктора: OFFSET против курсора'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Количество приёмов у одного доктора')
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000, 3000])
+        parser.add_argument('--repeat', type=int, default=10, help='Повторов каждого запроса')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные после замера')
+
+    def handle(self, *args, **options):
+        doctors, _ = seed_appointments(options['rows'], 1, 100)
+        try:
+            self.compare(doctors[0], options['pages'], options['repeat'])
+        finally:
+            if not options['keep']:
+                delete_seed()
+
+    def compare(self, doctor, pages, repeat):
+        factory = RequestFactory()
+        view = DoctorAllHistoryListView()
+        view.request = factory.get('/')
+        view.request.user = doctor
+        view.kwargs = {}
+        page_size = view.paginate_by
+        queryset = view.get_queryset()
+        paginator = Paginator(queryset, page_size)
+
+        self.stdout.write(f'{"страница":>10} {"OFFSET, мс":>12} {"курсор, мс":>12}')
+        for number in pages:
+            if number > paginator.num_pages:
+                break
+
+            offset_time = self.timeit(lambda: list(paginator.page(number).object_list), repeat)
+
+            # Курсор строится по последней записи предыдущей страницы и в замер не входит
+            params = {}
+            if number > 1:
+                params[view.after_kwarg] = encode_cursor(queryset[(number - 1) * page_size - 1])
+            view.request = factory.get('/', params)
+            view.request.user = doctor
+            keyset_time = self.timeit(lambda: view.paginate_queryset(view.get_queryset(), page_size), repeat)
+
+            self.stdout.write(f'{number:>10} {offset_time:>12.2f} {keyset_time:>12.2f}')
+
+    def timeit(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
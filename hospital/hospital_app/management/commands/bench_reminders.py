@@ -0,0 +1,73 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from hospital_app.models import Appointment
+from hospital_app.reminders import ReminderScheduler, pending_reminders
+
+from ._seed import seed_appointments, delete_seed
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает полный просмотр будущих приёмов с окном планировщика напоминаний'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Количество будущих приёмов')
+        parser.add_argument('--doctors', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого замера')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные после замера')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        seed_appointments(options['rows'], options['doctors'], options['rows'] // 10 or 1)
+        self.stdout.write(f'Создано {options["rows"]} приёмов за {time.perf_counter() - started:.0f} с')
+        try:
+            self.compare(timedelta(hours=settings.REMINDER_HOURS), options['repeat'])
+        finally:
+            if not options['keep']:
+                delete_seed()
+
+    def compare(self, lead, repeat):
+        now = timezone.now()
+
+        def naive():
+            # Как cron раз в минуту: все неотправленные напоминания, отбор наступивших в Python
+            rows = Appointment.objects.filter(reminder_sent_at__isnull=True).exclude(
+                status=Appointment.Status.CANCELLED
+            ).values_list('id', 'start_date_time')
+            return [pk for pk, start in rows if now < start <= now + lead]
+
+        def first_sync():
+            scheduler = ReminderScheduler(lead)
+            scheduler.refill(now)
+            return list(scheduler.due(now))
+
+        # Без сверок: замеряется только дозагрузка полосы окна
+        scheduler = ReminderScheduler(lead, resync=timedelta(days=1))
+        scheduler.refill(now)
+        list(scheduler.due(now))
+        minute = [now]
+
+        def step():
+            # Обычный шаг раз в минуту после запуска: дозагрузка одной полосы окна
+            minute[0] += timedelta(minutes=1)
+            scheduler.refill(minute[0])
+            return list(scheduler.due(minute[0]))
+
+        window = pending_reminders(now + lead, now + lead + scheduler.window)
+        self.stdout.write('План запроса окна:')
+        self.stdout.write(window.explain())
+
+        self.stdout.write(f'{"способ":<28} {"мс":>10} {"напоминаний":>12}')
+        for title, func in (('полный просмотр', naive), ('первая загрузка окна', first_sync),
+                            ('шаг раз в минуту', step)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = func()
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{title:<28} {statistics.median(timings):>10.2f} {len(result):>12}')
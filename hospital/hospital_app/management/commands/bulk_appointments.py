@@ -0,0 +1,64 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hospital_app import bulk
+from hospital_app.forms import BatchCloseForm, BatchReassignForm, BatchShiftForm
+from hospital_app.models import Appointment
+
+
+class Command(BaseCommand):
+    help = 'Массово переносит, передаёт другому доктору, закрывает или отменяет приёмы одной транзакцией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=['shift', 'reassign', 'close', 'cancel'])
+        parser.add_argument('--ids', type=int, nargs='+', help='id приёмов')
+        parser.add_argument('--doctor', type=int, help='Все неотменённые приёмы доктора (вместе с --date)')
+        parser.add_argument('--date', type=datetime.fromisoformat, help='Первый день, ГГГГ-ММ-ДД')
+        parser.add_argument('--date-to', type=datetime.fromisoformat, help='Последний день (по умолчанию --date)')
+        parser.add_argument('--days', type=int, default=0, help='shift: сдвиг в днях')
+        parser.add_argument('--minutes', type=int, default=0, help='shift: сдвиг в минутах')
+        parser.add_argument('--to', type=int, help='reassign: id нового доктора')
+        parser.add_argument('--readings', help='close: ответ доктора')
+
+    def handle(self, *args, **options):
+        queryset = self.select(options)
+        operation = options['operation']
+        # Параметры проверяются теми же формами, что и в админке
+        if operation == 'shift':
+            data = self.clean(BatchShiftForm, days=options['days'], minutes=options['minutes'])
+            change = (bulk.shift, timedelta(days=data['days'], minutes=data['minutes']))
+        elif operation == 'reassign':
+            change = (bulk.reassign, self.clean(BatchReassignForm, doctor=options['to'])['doctor'])
+        elif operation == 'close':
+            change = (bulk.close, self.clean(BatchCloseForm, readings=options['readings'])['readings'])
+        else:
+            change = (bulk.cancel,)
+
+        try:
+            count = bulk.apply_batch(queryset, *change)
+        except bulk.BatchConflict as e:
+            lines = [f'{appointment.pk} ({timezone.localtime(appointment.start_date_time):%d-%m-%Y %H:%M}): {message}'
+                     for appointment, message in e.conflicts]
+            raise CommandError('Ни один приём не изменён:\n' + '\n'.join(lines))
+        self.stdout.write(f'Изменено приёмов: {count}')
+
+    def select(self, options):
+        if options['ids']:
+            return Appointment.objects.filter(pk__in=options['ids'])
+        if options['doctor'] is None or options['date'] is None:
+            raise CommandError('Укажите --ids или --doctor вместе с --date')
+        first = options['date'].date()
+        last = (options['date_to'] or options['date']).date()
+        return Appointment.objects.filter(
+            doctor_id=options['doctor'],
+            start_date_time__gte=timezone.make_aware(datetime.combine(first, time.min)),
+            start_date_time__lt=timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)),
+        ).exclude(status=Appointment.Status.CANCELLED)
+
+    def clean(self, form_class, **data):
+        form = form_class({key: value for key, value in data.items() if value is not None})
+        if not form.is_valid():
+            raise CommandError('; '.join(message for errors in form.errors.values() for message in errors))
+        return form.cleaned_data
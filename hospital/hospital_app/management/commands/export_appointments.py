@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from hospital_app.export import export_lines, export_queryset, FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка приёмов в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, help='id доктора')
+        parser.add_argument('--date-from', type=date.fromisoformat, help='Начало периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--date-to', type=date.fromisoformat, help='Конец периода включительно, ГГГГ-ММ-ДД')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        queryset = export_queryset(options['doctor'], options['date_from'], options['date_to'])
+        lines = export_lines(queryset, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from hospital_app.jobs import claim, run_job
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из таблицы очереди пулом потоков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Потоков выполнения')
+        parser.add_argument('--poll', type=float, default=1.0, help='Пауза при пустой очереди, секунд')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        with ThreadPoolExecutor(threads, thread_name_prefix='job') as pool:
+            try:
+                while True:
+                    # Берём не больше, чем потоков, - остальное достанется соседним воркерам
+                    jobs = claim(threads)
+                    for job in pool.map(self.run, jobs):
+                        self.stdout.write(f'{job.name} #{job.pk}: {job.get_status_display()}')
+                    if not jobs:
+                        if options['once']:
+                            break
+                        close_old_connections()
+                        time.sleep(options['poll'])
+            except KeyboardInterrupt:
+                pass
+
+    def run(self, job):
+        try:
+            return run_job(job)
+        finally:
+            # У каждого потока своё соединение с БД - не оставляем его открытым между задачами
+            close_old_connections()
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from hospital_app.reminders import ReminderScheduler, REMINDER_WINDOW, RESYNC_INTERVAL
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь напоминания пациентам за REMINDER_HOURS часов до приёма'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-hours', type=float, default=settings.REMINDER_HOURS,
+                            help='За сколько часов до начала напоминать')
+        parser.add_argument('--window-minutes', type=float, default=REMINDER_WINDOW.total_seconds() / 60,
+                            help='Насколько вперёд загружать напоминания')
+        parser.add_argument('--resync-minutes', type=float, default=RESYNC_INTERVAL.total_seconds() / 60,
+                            help='Как часто перечитывать весь интервал до приёмов')
+        parser.add_argument('--max-sleep', type=float, default=60, help='Самый долгий сон между шагами, секунд')
+        parser.add_argument('--once', action='store_true', help='Один шаг (для запуска из cron)')
+
+    def handle(self, *args, **options):
+        scheduler = ReminderScheduler(
+            lead=timedelta(hours=options['lead_hours']),
+            window=timedelta(minutes=options['window_minutes']),
+            resync=timedelta(minutes=options['resync_minutes']),
+        )
+        try:
+            while True:
+                now = timezone.now()
+                sent = scheduler.run_once(now)
+                if sent:
+                    self.stdout.write(f'{now:%Y-%m-%d %H:%M:%S}: напоминаний в очереди {sent}')
+                if options['once']:
+                    break
+                close_old_connections()
+                time.sleep(min(scheduler.next_wakeup(timezone.now()), options['max_sleep']))
+        except KeyboardInterrupt:
+            pass
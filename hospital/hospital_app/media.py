@@ -0,0 +1,126 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date
+
+from users.thumbnails import photo_source
+
+from .directory import get_doctor_photos
+from .middleware import file_variant, is_not_modified
+
+PUBLIC_CACHE_CONTROL = 'public, max-age=3600'
+# Закрытые файлы кешируются только браузером, не общими прокси
+PRIVATE_CACHE_CONTROL = 'private, max-age=3600'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_access(user, name):
+    # Как кешировать файл name для user: PUBLIC/PRIVATE_CACHE_CONTROL; None - файл не показывается
+    if name.startswith(tuple(settings.MEDIA_PUBLIC_PATHS)):
+        return PUBLIC_CACHE_CONTROL
+    if name.startswith('users/'):
+        # Доступ к миниатюре - как к её исходнику; имена сравниваются целиком, с расширением
+        source = photo_source(name)
+        # Фото докторов выводятся на открытой странице персонала
+        if source in get_doctor_photos():
+            return PUBLIC_CACHE_CONTROL
+        if user.is_authenticated and user.photo and user.photo.name == source:
+            return PRIVATE_CACHE_CONTROL
+    return PRIVATE_CACHE_CONTROL if user.is_staff else None
+
+
+def parse_range(header, size):
+    # Один диапазон bytes=начало-конец или bytes=-длина_хвоста -> (начало, конец включительно).
+    # None - отдать файл целиком (нет заголовка, несколько диапазонов, ошибка в записи),
+    # ValueError - диапазон за концом файла (416)
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange:
+    # Файл, который читается только до конца диапазона. fileno() остаётся доступным: WSGI-сервер
+    # с wsgi.file_wrapper (gunicorn, uWSGI) передаёт Content-Length байт с текущей позиции через sendfile
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def serve_media(request, name, cache_control):
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        variant = file_variant(path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    # Каталог под открытым префиксом (/media/photos/) проходит проверку доступа, но это не файл
+    if not os.path.isfile(path):
+        raise Http404
+    headers = {
+        'Cache-Control': cache_control,
+        'ETag': variant.etag,
+        'Last-Modified': http_date(variant.mtime),
+        'Accept-Ranges': 'bytes',
+    }
+    if is_not_modified(request, variant):
+        return HttpResponseNotModified(headers=headers)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    # Доступ проверен - сам файл передаёт фронтенд-сервер, с Range и без потока Django
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        return HttpResponse(content_type=content_type, headers={
+            **headers, 'X-Accel-Redirect': settings.MEDIA_ACCEL_PREFIX + filepath_to_uri(name),
+        })
+    if settings.MEDIA_SENDFILE == 'x-sendfile':
+        return HttpResponse(content_type=content_type, headers={**headers, 'X-Sendfile': path})
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip() == variant.etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), variant.size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{variant.size}'})
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), status=206, content_type=content_type)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{variant.size}'
+        response.headers['Content-Length'] = end - start + 1
+    for header, value in headers.items():
+        response.headers[header] = value
+    return response
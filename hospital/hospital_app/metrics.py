@@ -0,0 +1,231 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.template.backends import django as django_backend
+
+# Метрики собираются в памяти процесса; при нескольких воркерах gunicorn каждый отдаёт свои
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Прочие методы пишутся как 'other': значение метки приходит от клиента
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> [число наблюдений в каждой корзине..., в +Inf, сумма]; накопленные
+        # значения корзин считаются только при выводе
+        self.values = {}
+
+    def observe(self, labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        bounds = [format_value(float(bound)) for bound in self.buckets] + ['+Inf']
+        for labels, series in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(bounds, series):
+                total += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, le)} {total}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {format_value(series[-1])}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {total}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Текстовый формат Prometheus 0.0.4
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric.values.clear()
+
+
+registry = Registry()
+REQUESTS = registry.register(Counter(
+    'hospital_http_requests_total', 'Обработанные запросы', ('view', 'method', 'status')))
+REQUEST_DURATION = registry.register(Histogram(
+    'hospital_http_request_duration_seconds', 'Время до ответа (для потоковых ответов - до заголовков)',
+    ('view',)))
+DB_QUERIES = registry.register(Histogram(
+    'hospital_db_queries_per_request', 'Запросов к БД за один HTTP-запрос', ('view',), QUERY_COUNT_BUCKETS))
+DB_DURATION = registry.register(Counter(
+    'hospital_db_query_duration_seconds_total', 'Суммарное время запросов к БД', ('view',)))
+TEMPLATE_DURATION = registry.register(Histogram(
+    'hospital_template_render_seconds', 'Время отрисовки шаблона страницы', ('view',)))
+
+
+@dataclass
+class RequestStats:
+    started: float
+    queries: int = 0
+    query_time: float = 0.0
+    template_time: float = 0.0
+    # Шаблон, отрисованный внутри другого, уже учтён во внешнем
+    template_depth: int = 0
+
+
+# Статистика текущего запроса; контекст копируется и в потоки sync_to_async
+current_stats = ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Обёртка execute_wrapper, постоянно установленная на каждом соединении (см. install_query_recorder):
+    # вне запроса - только чтение ContextVar
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    # connection.execute_wrapper() действует только в своём потоке, а async-представления ходят
+    # в БД из потоков sync_to_async - поэтому обёртка ставится на соединение при его создании
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = current_stats.get()
+        if stats is None:
+            return super().render(context, request)
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    # Тот же движок шаблонов Django, но с замером отрисовки (TEMPLATES['BACKEND'])
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Имя маршрута ('home', 'users:profile'), а не путь: число рядов метрик не растёт с числом id в URL
+    return match.view_name if match is not None else '<unmatched>'
+
+
+def record(request, response, stats):
+    view = view_name(request)
+    with registry.lock:
+        method = request.method if request.method in METHODS else 'other'
+        REQUESTS.inc((view, method, str(response.status_code)))
+        REQUEST_DURATION.observe((view,), time.perf_counter() - stats.started)
+        DB_QUERIES.observe((view,), stats.queries)
+        DB_DURATION.inc((view,), stats.query_time)
+        if stats.template_time:
+            TEMPLATE_DURATION.observe((view,), stats.template_time)
+
+
+class MetricsMiddleware:
+    # Время ответа, запросы к БД и отрисовка шаблонов по именам маршрутов.
+    # И синхронный, и асинхронный: под ASGI async-представления не уходят в поток из-за middleware
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats(time.perf_counter())
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        record(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(time.perf_counter())
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        record(request, response, stats)
+        return response
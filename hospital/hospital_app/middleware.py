@@ -0,0 +1,154 @@
+import json
+import mimetypes
+import os
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+from django.views.static import was_modified_since
+
+# Сжатые копии рядом с файлом (см. hospital_app.storage) в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Имена с хешем содержимого не меняются: браузер может не перепроверять их год
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Файлы без хеша (styles.css) могут измениться при следующем выпуске
+CACHE_CONTROL = 'public, max-age=60'
+
+
+@dataclass(frozen=True)
+class Variant:
+    path: str
+    size: int
+    mtime: int
+    etag: str
+
+
+@dataclass(frozen=True)
+class StaticFile:
+    content_type: str
+    cache_control: str
+    # {кодировка: Variant}; '' - исходный файл
+    variants: dict
+
+
+def file_variant(path, suffix=''):
+    stat = os.stat(path)
+    return Variant(path, stat.st_size, int(stat.st_mtime), f'"{int(stat.st_mtime):x}-{stat.st_size:x}{suffix}"')
+
+
+def index_static_root(root):
+    # Один обход STATIC_ROOT при запуске: запрос к статике - поиск в словаре, без обращений к диску
+    hashed = set()
+    manifest = os.path.join(root, 'staticfiles.json')
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as file:
+            hashed = set(json.load(file).get('paths', {}).values())
+
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if any(name.endswith(suffix) and os.path.exists(path[:-len(suffix)]) for _, suffix in ENCODINGS):
+                continue
+            variants = {'': file_variant(path)}
+            for encoding, suffix in ENCODINGS:
+                if os.path.exists(path + suffix):
+                    variants[encoding] = file_variant(path + suffix, f'-{encoding}')
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            files[name] = StaticFile(content_type, IMMUTABLE_CACHE_CONTROL if name in hashed else CACHE_CONTROL,
+                                     variants)
+    return files
+
+
+def is_not_modified(request, variant):
+    # If-None-Match важнее If-Modified-Since (RFC 9110, 13.2.2)
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or variant.etag in etags
+    return not was_modified_since(request.headers.get('If-Modified-Since'), variant.mtime)
+
+
+def accepted_encodings(header):
+    # Accept-Encoding: gzip, deflate, br;q=0.9 -> {'gzip', 'deflate', 'br'}; q=0 означает отказ
+    accepted = set()
+    for item in header.split(','):
+        encoding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if encoding and quality > 0:
+            accepted.add(encoding.lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    # Отдаёт собранную статику из STATIC_ROOT раньше сессий и представлений: сжатую копию по
+    # Accept-Encoding, долгий кеш для имён с хешем и 304 по If-None-Match/If-Modified-Since.
+    # Работает и под WSGI, и под ASGI; при DEBUG статику отдаёт runserver.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        url = urlsplit(settings.STATIC_URL or '')
+        if settings.DEBUG or url.netloc or not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+            raise MiddlewareNotUsed
+        self.prefix = '/' + url.path.strip('/') + '/'
+        self.files = index_static_root(settings.STATIC_ROOT)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is not None:
+            return self.serve(request, static_file)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Поиск по индексу и открытие файла не блокируют; остальные запросы идут дальше без потока
+        static_file = self.find(request)
+        if static_file is not None:
+            return self.serve(request, static_file)
+        return await self.get_response(request)
+
+    def find(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            return self.files.get(request.path_info[len(self.prefix):])
+        return None
+
+    def serve(self, request, static_file):
+        encoding = ''
+        if len(static_file.variants) > 1:
+            accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+            encoding = next((name for name, _ in ENCODINGS if name in accepted and name in static_file.variants), '')
+        variant = static_file.variants[encoding]
+
+        headers = {
+            'Cache-Control': static_file.cache_control,
+            'ETag': variant.etag,
+            'Last-Modified': http_date(variant.mtime),
+        }
+        if len(static_file.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if is_not_modified(request, variant):
+            return HttpResponseNotModified(headers=headers)
+
+        response = FileResponse(open(variant.path, 'rb'), content_type=static_file.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
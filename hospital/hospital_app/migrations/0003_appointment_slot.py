@@ -0,0 +1,92 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import hospital_app.models
+
+
+def fill_slots(apps, schema_editor):
+    Appointment = apps.get_model('hospital_app', 'Appointment')
+    appointments = Appointment.objects.only('id', 'start_date_time').iterator(chunk_size=1000)
+    batch = []
+    for appointment in appointments:
+        appointment.slot = hospital_app.models.slot_for(appointment.start_date_time)
+        batch.append(appointment)
+        if len(batch) == 1000:
+            Appointment.objects.bulk_update(batch, ['slot'])
+            batch = []
+    Appointment.objects.bulk_update(batch, ['slot'])
+
+
+def check_collisions(apps, schema_editor):
+    # Раньше запись не проверялась, и в базе могут быть пересекающиеся приёмы одного доктора
+    # или пациента. Какой из них настоящий, решает администратор: миграция останавливается
+    # со списком, а не отменяет и не удаляет приёмы сама. Проверка идёт до изменения схемы -
+    # MySQL не откатывает DDL, и прерванную на середине миграцию нельзя было бы повторить
+    Appointment = apps.get_model('hospital_app', 'Appointment')
+    taken = {}
+    appointments = Appointment.objects.only('id', 'doctor', 'patient', 'start_date_time').order_by(
+        'start_date_time', 'id').iterator(chunk_size=1000)
+    for appointment in appointments:
+        slot = hospital_app.models.slot_for(appointment.start_date_time)
+        for key in (('доктор', appointment.doctor_id, slot), ('пациент', appointment.patient_id, slot)):
+            taken.setdefault(key, []).append(appointment)
+    report = [
+        f'{label} id={party_id}: ' + ', '.join(
+            f'#{appointment.pk} ({appointment.start_date_time:%d.%m.%Y %H:%M})' for appointment in clashing)
+        for (label, party_id, _), clashing in taken.items() if len(clashing) > 1
+    ]
+    if report:
+        raise RuntimeError(
+            'Пересекающиеся приёмы (один слот в 30 минут у доктора или пациента). Перенесите или удалите '
+            'лишние и повторите migrate:\n' + '\n'.join(report)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital_app', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_collisions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='complaint',
+            field=models.CharField(blank=True, max_length=500, validators=[hospital_app.models.RussianLettersValidator()], verbose_name='Жалобы'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='end_date_time',
+            field=models.DateTimeField(verbose_name='Звершение приёма'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='readings',
+            field=models.TextField(blank=True, validators=[hospital_app.models.RussianLettersValidator()], verbose_name='Ответ доктора'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='start_date_time',
+            field=models.DateTimeField(verbose_name='Начало приёма'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='slot',
+            field=models.IntegerField(editable=False, null=True, verbose_name='Слот'),
+        ),
+        migrations.RunPython(fill_slots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='slot',
+            field=models.IntegerField(editable=False, verbose_name='Слот'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('doctor', 'slot'), name='appointment_doctor_slot_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('patient', 'slot'), name='appointment_patient_slot_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital_app', '0003_appointment_slot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', '-start_date_time'], name='appt_doctor_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', '-start_date_time'], name='appt_patient_start_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:15
+
+from django.db import migrations, models
+from django.db.models import Max
+
+BATCH_SIZE = 1000
+
+
+def fill_status(apps, schema_editor):
+    # Заявки с ответом доктора переводим в answered пачками по диапазонам pk
+    Appointment = apps.get_model('hospital_app', 'Appointment')
+    last_id = Appointment.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    for start in range(0, last_id + 1, BATCH_SIZE):
+        Appointment.objects.filter(
+            id__gte=start, id__lt=start + BATCH_SIZE
+        ).exclude(readings='').update(status='answered')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital_app', '0004_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает ответа'), ('answered', 'Есть ответ'), ('cancelled', 'Отменён')], default='pending', max_length=16, verbose_name='Статус'),
+        ),
+        migrations.RunPython(fill_status, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='slot',
+            field=models.IntegerField(editable=False, null=True, verbose_name='Слот'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'status', '-start_date_time'], name='appt_doctor_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'status', '-start_date_time'], name='appt_patient_status_idx'),
+        ),
+    ]
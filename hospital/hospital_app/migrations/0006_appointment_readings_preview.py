@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital_app', '0005_appointment_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='readings_preview',
+            field=models.TextField(blank=True, editable=False, verbose_name='Начало ответа доктора'),
+        ),
+    ]
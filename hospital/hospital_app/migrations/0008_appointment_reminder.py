@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital_app', '0007_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Напоминание отправлено'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start_date_time', 'reminder_sent_at'], name='appt_reminder_idx'),
+        ),
+    ]
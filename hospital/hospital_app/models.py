@@ -3,6 +3,25 @@ from django.db import models
 from datetime import timedelta
 
 from django.core.validators import RegexValidator
+from django.utils.html import linebreaks
+from django.utils.text import Truncator
+
+# Длительность приёма; расписание врача делится на слоты такой длины
+SLOT_MINUTES = 30
+
+
+# Сколько слов заключения доктора показывать в списках
+PREVIEW_WORDS = 40
+
+
+def conclusion_preview(readings):
+    # Готовый к выводу HTML: текст экранирован, обрезан и разбит на абзацы один раз при сохранении
+    return linebreaks(Truncator(readings).words(PREVIEW_WORDS), autoescape=True) if readings else ''
+
+
+def slot_for(value):
+    # Номер слота - количество интервалов по SLOT_MINUTES от начала эпохи
+    return int(value.timestamp()) // (SLOT_MINUTES * 60)
 
 
 class RussianLettersValidator(RegexValidator):
@@ -14,6 +33,11 @@ class RussianLettersValidator(RegexValidator):
 
 
 class Appointment(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Ожидает ответа'
+        ANSWERED = 'answered', 'Есть ответ'
+        CANCELLED = 'cancelled', 'Отменён'
+
     patient = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='patient_visits',
                                 verbose_name='Пациент')
     doctor = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='doctor_visits',
@@ -23,12 +47,92 @@ class Appointment(models.Model):
     complaint = models.CharField(max_length=500, validators=[RussianLettersValidator()],
                                  blank=True, verbose_name='Жалобы')
     readings = models.TextField(blank=True, validators=[RussianLettersValidator()], verbose_name="Ответ доктора")
+    readings_preview = models.TextField(blank=True, editable=False, verbose_name='Начало ответа доктора')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING,
+                              verbose_name='Статус')
+    # У отменённых приёмов слот пустой, чтобы время можно было занять снова
+    slot = models.IntegerField(editable=False, null=True, verbose_name='Слот')
+    # Когда отправлено напоминание; отмечается до отправки, чтобы повторный запуск не прислал второе
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                            verbose_name='Напоминание отправлено')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', '-start_date_time'], name='appt_doctor_start_idx'),
+            models.Index(fields=['patient', '-start_date_time'], name='appt_patient_start_idx'),
+            # Не частичные (condition=status) индексы: MySQL их не поддерживает и Django их пропустил бы,
+            # а составной индекс со status служит спискам по статусу на любом бэкенде
+            models.Index(fields=['doctor', 'status', '-start_date_time'], name='appt_doctor_status_idx'),
+            models.Index(fields=['patient', 'status', '-start_date_time'], name='appt_patient_status_idx'),
+            # Планировщик напоминаний читает только ближайшее окно по времени начала
+            models.Index(fields=['start_date_time', 'reminder_sent_at'], name='appt_reminder_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'slot'], name='appointment_doctor_slot_unique'),
+            models.UniqueConstraint(fields=['patient', 'slot'], name='appointment_patient_slot_unique'),
+        ]
+
+    # Значения при загрузке из БД: по ним save() узнаёт о переносе приёма, а сигналы - о смене доктора
+    TRACKED_FIELDS = ('start_date_time', 'doctor_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = {name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS}
+        return instance
+
+    def loaded_value(self, name):
+        # None - приём новый или поле не загружалось
+        return getattr(self, '_loaded', {}).get(name)
 
     def save(self, *args, **kwargs):
+        # О перенесённом приёме пациенту нужно напомнить заново (админка, форма доктора и т.п.)
+        loaded_start = self.loaded_value('start_date_time')
+        if loaded_start is not None and loaded_start != self.start_date_time and self.reminder_sent_at:
+            self.reminder_sent_at = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'reminder_sent_at'}
         # Автоматически устанавливаем end_date_time только если он не был задан
         if self.end_date_time is None or not self.end_date_time:
-            self.end_date_time = self.start_date_time + timedelta(minutes=30)
+            self.end_date_time = self.start_date_time + timedelta(minutes=SLOT_MINUTES)
+        # Статус следует за ответом доктора, отменённый приём остаётся отменённым
+        if self.status != self.Status.CANCELLED:
+            self.status = self.Status.ANSWERED if self.readings else self.Status.PENDING
+        self.readings_preview = conclusion_preview(self.readings)
+        self.slot = None if self.status == self.Status.CANCELLED else slot_for(self.start_date_time)
         super().save(*args, **kwargs)
+        self._loaded = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
 
     def __str__(self):
         return f"{self.patient} with {self.doctor} from {self.start_date_time} to {self.end_date_time}"
+
+
+class Job(models.Model):
+    # Отложенная задача (письмо и т.п.), выполняется командой run_worker вне запроса
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        DEAD = 'dead', 'Не выполнена'
+
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    payload = models.JSONField(default=dict, verbose_name='Параметры')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED, verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(verbose_name='Выполнить не раньше')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взята в работу')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершена')
+
+    class Meta:
+        indexes = [
+            # Выборка воркера: готовые к запуску задачи по времени
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
@@ -0,0 +1,72 @@
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from .jobs import task
+from .models import Appointment
+
+
+def load_appointment(appointment_id):
+    return Appointment.objects.select_related('doctor', 'patient').filter(pk=appointment_id).first()
+
+
+@task('appointment_booked')
+def appointment_booked(appointment_id):
+    # Доктору - о новой записи пациента
+    appointment = load_appointment(appointment_id)
+    if appointment is None or not appointment.doctor.email:
+        return
+    start = timezone.localtime(appointment.start_date_time).strftime('%d-%m-%Y %H:%M')
+    send_mail(
+        'Новая запись на приём',
+        f'{appointment.patient.get_full_name() or appointment.patient.username} записался к вам на {start}.\n'
+        f'Жалобы: {appointment.complaint or "не указаны"}',
+        None,
+        [appointment.doctor.email],
+    )
+
+
+@task('appointments_booked')
+def appointments_booked(appointment_ids):
+    # Доктору - одно письмо о серии приёмов вместо письма на каждый
+    appointments = list(Appointment.objects.select_related('doctor', 'patient')
+                        .filter(pk__in=appointment_ids).order_by('start_date_time'))
+    if not appointments or not appointments[0].doctor.email:
+        return
+    patient = appointments[0].patient
+    dates = '\n'.join(timezone.localtime(a.start_date_time).strftime('%d-%m-%Y %H:%M') for a in appointments)
+    send_mail(
+        'Новая серия записей на приём',
+        f'{patient.get_full_name() or patient.username} записался к вам на приёмы:\n{dates}',
+        None,
+        [appointments[0].doctor.email],
+    )
+
+
+@task('appointment_answered')
+def appointment_answered(appointment_id):
+    # Пациенту - о заключении доктора
+    appointment = load_appointment(appointment_id)
+    if appointment is None or not appointment.patient.email or not appointment.readings:
+        return
+    start = timezone.localtime(appointment.start_date_time).strftime('%d-%m-%Y %H:%M')
+    send_mail(
+        'Доктор ответил на ваше обращение',
+        f'Доктор {appointment.doctor.get_full_name()} ответил на обращение от {start}:\n\n{appointment.readings}',
+        None,
+        [appointment.patient.email],
+    )
+
+
+@task('appointment_reminder')
+def appointment_reminder(appointment_id):
+    # Пациенту - накануне приёма
+    appointment = load_appointment(appointment_id)
+    if appointment is None or not appointment.patient.email or appointment.status == Appointment.Status.CANCELLED:
+        return
+    start = timezone.localtime(appointment.start_date_time).strftime('%d-%m-%Y %H:%M')
+    send_mail(
+        'Напоминание о приёме',
+        f'Напоминаем: {start} у вас приём у доктора {appointment.doctor.get_full_name()}.',
+        None,
+        [appointment.patient.email],
+    )
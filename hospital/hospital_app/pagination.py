@@ -0,0 +1,126 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def encode_cursor(obj):
+    value = f'{obj.start_date_time.isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Возвращает (start_date_time, pk) или None для испорченного курсора
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        start, pk = value.split('|')
+        return datetime.fromisoformat(start), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous else None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginationMixin:
+    # Постраничный вывод по ключу (start_date_time, id) от новых к старым.
+    # В отличие от OFFSET стоимость любой страницы равна стоимости первой:
+    # условие start_date_time <= курсора даёт СУБД диапазон по индексу.
+    paginate_by = 20
+    after_kwarg = 'after'
+    before_kwarg = 'before'
+
+    def paginate_queryset(self, queryset, page_size):
+        queryset, after, before = self.get_page_queryset(queryset, page_size)
+        return self.make_page(list(queryset), page_size, after, before)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        # То же для async-представлений: строки страницы читаются через async ORM
+        queryset, after, before = self.get_page_queryset(queryset, page_size)
+        return self.make_page([obj async for obj in queryset], page_size, after, before)
+
+    def get_page_queryset(self, queryset, page_size):
+        # Одна лишняя строка показывает, есть ли страница дальше
+        after = decode_cursor(self.request.GET.get(self.after_kwarg, ''))
+        before = decode_cursor(self.request.GET.get(self.before_kwarg, '')) if after is None else None
+
+        if before is not None:
+            start, pk = before
+            queryset = queryset.filter(
+                Q(start_date_time__gte=start) & (Q(start_date_time__gt=start) | Q(pk__gt=pk))
+            ).order_by('start_date_time', 'pk')
+        else:
+            queryset = queryset.order_by('-start_date_time', '-pk')
+            if after is not None:
+                start, pk = after
+                queryset = queryset.filter(
+                    Q(start_date_time__lte=start) & (Q(start_date_time__lt=start) | Q(pk__lt=pk))
+                )
+        return queryset[:page_size + 1], after, before
+
+    def make_page(self, rows, page_size, after, before):
+        if before is not None:
+            has_previous = len(rows) > page_size
+            page = KeysetPage(rows[:page_size][::-1], has_next=True, has_previous=has_previous)
+        else:
+            page = KeysetPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=after is not None)
+
+        if not page.object_list:
+            page.has_next = page.has_previous = False
+        return None, page, page.object_list, page.has_other_pages()
+
+
+def estimated_count(model, using='default'):
+    # Оценка числа строк из статистики СУБД без COUNT(*) по всей таблице; None - оценки нет
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    # Для списка без фильтров число строк берётся из статистики таблицы: точный COUNT
+    # по большой таблице дороже самой страницы. С фильтром считается точно - по индексу.
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        return super().count
@@ -0,0 +1,166 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+# Файлы профилей: 20240131-101500-doctor_answer-1234ms-1a2b3c4d.prof (или .collapsed)
+PROFILE_NAME_RE = re.compile(r'^(\d{8}-\d{6})-([\w.-]+)-(\d+)ms-[0-9a-f]{8}\.(prof|collapsed)$')
+FORMATS = ('prof', 'collapsed')
+# Глубже стеки в collapsed-формате обрезаются, ветви короче 10 мкс отбрасываются
+MAX_STACK_DEPTH = 128
+MIN_STACK_SECONDS = 0.00001
+
+
+@dataclass(frozen=True)
+class ProfileFile:
+    name: str
+    view: str
+    duration_ms: int
+    created: datetime
+    size: int
+    format: str
+
+
+def function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        # Встроенные функции: "<built-in method time.sleep>"
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapsed_stacks(stats):
+    # cProfile хранит не стеки, а рёбра "вызывающий -> вызываемый" со временем. Стеки для
+    # флеймграфа (строки "a;b;c микросекунды", формат flamegraph.pl/speedscope) восстанавливаются
+    # обходом от корней: время функции делится между вызывающими пропорционально рёбрам.
+    # Функция, уже стоящая в стеке, не раскрывается повторно - иначе циклы графа (inner() между
+    # слоями middleware, декораторы, рекурсия) дают бесконечно много путей; такие слои сливаются в один
+    callees = {}
+    roots = []
+    for func, (_, calls, _, _, callers) in stats.stats.items():
+        # Корни - вызовы из кадра, в котором профилировщик включили: у них нет записанного вызывающего
+        if sum(edge[1] for edge in callers.values()) < calls:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    lines = {}
+
+    def visit(func, stack, share):
+        own = stats.stats[func][2]
+        stack = stack + [function_label(func)]
+        if own * share > 0:
+            key = ';'.join(stack)
+            lines[key] = lines.get(key, 0) + own * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_total in callees.get(func, ()):
+            callee_total = stats.stats[callee][3]
+            if share * edge_total >= MIN_STACK_SECONDS and function_label(callee) not in stack:
+                visit(callee, stack, share * edge_total / callee_total)
+
+    for root in roots:
+        visit(root, [], 1.0)
+    return [f'{stack} {round(seconds * 1_000_000)}' for stack, seconds in sorted(lines.items())
+            if round(seconds * 1_000_000)]
+
+
+def save_profile(profiler, view, duration, output_format, directory=None):
+    directory = directory or settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    view = re.sub(r'[^\w.-]+', '_', view)[:60] or 'view'
+    name = (f'{timezone.localtime():%Y%m%d-%H%M%S}-{view}-{round(duration * 1000)}ms-'
+            f'{uuid.uuid4().hex[:8]}.{output_format}')
+    path = os.path.join(directory, name)
+    if output_format == 'collapsed':
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(collapsed_stacks(pstats.Stats(profiler))) + '\n')
+    else:
+        profiler.dump_stats(path)
+    rotate(directory, settings.PROFILING_KEEP)
+    return name
+
+
+def list_profiles(directory=None):
+    # Новые сверху; посторонние файлы в каталоге не показываются
+    directory = directory or settings.PROFILING_DIR
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in entries:
+        match = PROFILE_NAME_RE.match(entry.name)
+        if match and entry.is_file():
+            created, view, duration, output_format = match.groups()
+            created = datetime.strptime(created, '%Y%m%d-%H%M%S')
+            profiles.append(ProfileFile(entry.name, view, int(duration), created, entry.stat().st_size, output_format))
+    return sorted(profiles, key=lambda profile: profile.name, reverse=True)
+
+
+def rotate(directory, keep):
+    # Каталог ограничен keep последними профилями - при частой выборке диск не заполнится
+    for profile in list_profiles(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, profile.name))
+        except FileNotFoundError:
+            pass
+
+
+def profile_path(name, directory=None):
+    # Только имена, которые пишет save_profile: путь за пределы каталога не собрать
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(directory or settings.PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    # Выполняет запрос под cProfile: случайную долю PROFILING_SAMPLE_RATE запросов и запросы staff
+    # с заголовком PROFILING_HEADER (значение 'collapsed' - стеки для флеймграфа вместо .prof).
+    # Когда выключено и то и другое, middleware исключается из цепочки при запуске - затрат ноль.
+    # Только синхронный: cProfile видит лишь свой поток, а под ASGI Django выполнит его
+    # и синхронные представления в одном потоке.
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        header = settings.PROFILING_HEADER
+        if not self.sample_rate and not header:
+            raise MiddlewareNotUsed
+        self.header = header and 'HTTP_' + header.upper().replace('-', '_')
+
+    def __call__(self, request):
+        requested = self.header and request.META.get(self.header)
+        # Заголовок от не-staff игнорируется: иначе любой мог бы нагрузить сервер профилированием
+        requested = requested and request.user.is_staff
+        if requested:
+            output_format = request.META[self.header]
+            if output_format not in FORMATS:
+                output_format = settings.PROFILING_FORMAT
+        elif self.sample_rate and random.random() < self.sample_rate:
+            output_format = settings.PROFILING_FORMAT
+        else:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        name = save_profile(profiler, match.view_name if match else 'unmatched', duration, output_format)
+        if requested:
+            response.headers['X-Profile'] = name
+        return response
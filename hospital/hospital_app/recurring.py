@@ -0,0 +1,135 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .availability import invalidate_availability, is_working_time, merge_intervals
+from .booking import SLOT_DURATION, SlotConflict, book, is_slot_aligned
+from .jobs import enqueue
+from .models import Appointment, slot_for
+from .signals import notify_doctors
+
+FREQUENCIES = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+}
+# Больше приёмов одной серией не записывается (год еженедельных визитов)
+MAX_OCCURRENCES = 52
+
+
+def expand_rule(start, frequency, interval=1, count=None, until=None):
+    # Повторы считаются в местном времени: приём в 10:00 остаётся в 10:00 и после перевода часов
+    step = FREQUENCIES[frequency] * interval
+    local = timezone.localtime(start).replace(tzinfo=None)
+    limit = min(count or MAX_OCCURRENCES, MAX_OCCURRENCES)
+    occurrences = []
+    while len(occurrences) < limit and (until is None or local.date() <= until):
+        occurrences.append(timezone.make_aware(local))
+        local += step
+    return occurrences
+
+
+def busy_intervals(doctor_id, patient_id, period_start, period_end):
+    # Один запрос по диапазону: занятое время доктора и пациента за весь период серии
+    rows = Appointment.objects.filter(
+        Q(doctor_id=doctor_id) | Q(patient_id=patient_id),
+        start_date_time__lt=period_end,
+        end_date_time__gt=period_start,
+    ).exclude(
+        status=Appointment.Status.CANCELLED
+    ).order_by('start_date_time').values_list('doctor_id', 'patient_id', 'start_date_time', 'end_date_time')
+
+    doctor, patient = [], []
+    for row_doctor_id, row_patient_id, start, end in rows:
+        if row_doctor_id == doctor_id:
+            doctor.append((start, end))
+        if row_patient_id == patient_id:
+            patient.append((start, end))
+    return merge_intervals(doctor), merge_intervals(patient)
+
+
+def overlaps(merged, start, end):
+    # merged отсортированы и не пересекаются, поэтому концы тоже отсортированы
+    i = bisect_right([interval[1] for interval in merged], start)
+    return i < len(merged) and merged[i][0] < end
+
+
+def book_series(patient, doctor, starts, complaint='', now=None):
+    # Результат по каждому приёму серии: booked, conflict (занято) или invalid (время не подходит)
+    now = now or timezone.now()
+    results = []
+    candidates = []
+    for start in sorted(starts):
+        result = {'start_date_time': timezone.localtime(start).isoformat(), 'status': 'invalid', 'message': '',
+                  'id': None}
+        results.append(result)
+        if start < now:
+            result['message'] = 'Дата начала приёма не может быть в прошлом.'
+        elif not is_slot_aligned(start) or not is_working_time(start):
+            result['message'] = 'Выбранное время вне часов приёма клиники.'
+        else:
+            candidates.append((start, result))
+    if not candidates:
+        return results
+
+    doctor_busy, patient_busy = busy_intervals(doctor.pk, patient.pk, candidates[0][0],
+                                               candidates[-1][0] + SLOT_DURATION)
+    accepted = []
+    for start, result in candidates:
+        end = start + SLOT_DURATION
+        if overlaps(patient_busy, start, end):
+            result.update(status='conflict', message=SlotConflict.messages['patient'])
+        elif overlaps(doctor_busy, start, end):
+            result.update(status='conflict', message=SlotConflict.messages['doctor'])
+        else:
+            # bulk_create не вызывает save(): вычисляемые поля заполняются здесь
+            appointment = Appointment(
+                patient=patient, doctor=doctor, complaint=complaint,
+                start_date_time=start, end_date_time=end, slot=slot_for(start),
+                status=Appointment.Status.PENDING, readings='', readings_preview='',
+            )
+            accepted.append((appointment, result))
+    if accepted:
+        insert(accepted)
+    return results
+
+
+def insert(accepted):
+    # Серия пишется одной транзакцией: при любой ошибке не остаётся части приёмов. Слот, занятый
+    # между проверкой и вставкой, - такой же конфликт, как найденный запросом: он попадает в результат,
+    # остальные приёмы серии записываются в той же транзакции
+    appointments = [appointment for appointment, _ in accepted]
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                Appointment.objects.bulk_create(appointments)
+        except IntegrityError:
+            # Вставка откачена до точки сохранения - вставляем по одному, чтобы понять, какой слот занят
+            for appointment, result in accepted:
+                appointment.pk = None
+                try:
+                    book(appointment)
+                except SlotConflict as e:
+                    result.update(status='conflict', message=str(e))
+            accepted = [(appointment, result) for appointment, result in accepted if result['status'] != 'conflict']
+        else:
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # MySQL не возвращает ключи вставленных строк - находим их по слотам доктора
+                doctor = appointments[0].doctor_id
+                ids = dict(Appointment.objects.filter(
+                    doctor_id=doctor, slot__in=[appointment.slot for appointment in appointments]
+                ).values_list('slot', 'id'))
+                for appointment in appointments:
+                    appointment.pk = ids[appointment.slot]
+
+        if accepted:
+            # Сигналы post_save при массовой вставке не срабатывают; события и задача - после фиксации
+            notify_doctors([(appointment.pk, appointment.doctor_id) for appointment, _ in accepted])
+            enqueue('appointments_booked', appointment_ids=[appointment.pk for appointment, _ in accepted])
+
+    for appointment, result in accepted:
+        result.update(status='booked', id=appointment.pk)
+    if accepted:
+        invalidate_availability()
@@ -0,0 +1,94 @@
+import heapq
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import Appointment
+
+# Насколько вперёд планировщик загружает напоминания за один запрос
+REMINDER_WINDOW = timedelta(minutes=10)
+# Как часто перечитывается весь интервал до начала приёмов: записи, сделанные позже
+# загруженного окна, и перенесённые приёмы иначе не попали бы в очередь
+RESYNC_INTERVAL = timedelta(minutes=5)
+
+
+def pending_reminders(start_from, start_to):
+    # Диапазон по индексу (start_date_time, reminder_sent_at): только окно, а не вся таблица
+    return Appointment.objects.filter(
+        start_date_time__gte=start_from,
+        start_date_time__lt=start_to,
+        reminder_sent_at__isnull=True,
+    ).exclude(
+        status=Appointment.Status.CANCELLED
+    ).values_list('id', 'start_date_time')
+
+
+def mark_sent(appointment_id, start_date_time, now):
+    # Отметка ставится условным UPDATE: второй планировщик, перезапуск или перенесённый приём
+    # получат 0 строк, и напоминание не уйдёт дважды. Письмо отправит фоновая очередь.
+    with transaction.atomic():
+        marked = Appointment.objects.filter(
+            pk=appointment_id,
+            start_date_time=start_date_time,
+            start_date_time__gt=now,
+            reminder_sent_at__isnull=True,
+        ).exclude(status=Appointment.Status.CANCELLED).update(reminder_sent_at=now)
+        if marked:
+            enqueue('appointment_reminder', appointment_id=appointment_id)
+    return bool(marked)
+
+
+class ReminderScheduler:
+    # Куча (срок напоминания, id, начало приёма) для ближайшего окна.
+    # Окно дозагружается по мере движения времени, вся таблица не читается.
+    def __init__(self, lead, window=REMINDER_WINDOW, resync=RESYNC_INTERVAL):
+        self.lead = lead
+        self.window = window
+        self.resync = resync
+        self.heap = []
+        # id приёма -> начало, с которым он в куче; перенесённый приём добавляется заново
+        self.queued = {}
+        # Напоминания со сроком до loaded_until уже в куче
+        self.loaded_until = None
+        self.synced_at = None
+
+    def push(self, rows):
+        for appointment_id, start in rows:
+            if self.queued.get(appointment_id) != start:
+                self.queued[appointment_id] = start
+                heapq.heappush(self.heap, (start - self.lead, appointment_id, start))
+
+    def refill(self, now):
+        horizon = now + self.window
+        if self.synced_at is None or now - self.synced_at >= self.resync or now < self.synced_at:
+            # После запуска, периодически и при переводе часов назад: все ещё не начавшиеся
+            # приёмы, у которых срок напоминания наступит до конца окна
+            self.push(pending_reminders(now, horizon + self.lead))
+            self.synced_at = now
+        elif horizon > self.loaded_until:
+            # Обычный шаг: только полоса между прошлым и новым концом окна. Нижняя граница -
+            # прошлый конец окна, а не now: если часы прыгнули вперёд, полоса не теряется
+            self.push(pending_reminders(self.loaded_until + self.lead, horizon + self.lead))
+        self.loaded_until = max(horizon, self.loaded_until or horizon)
+
+    def due(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            _, appointment_id, start = heapq.heappop(self.heap)
+            if self.queued.get(appointment_id) == start:
+                del self.queued[appointment_id]
+            yield appointment_id, start
+
+    def run_once(self, now=None):
+        # Один шаг: дозагрузить окно и отметить наступившие напоминания; возвращает число отправленных
+        now = now or timezone.now()
+        self.refill(now)
+        return sum(mark_sent(appointment_id, start, now) for appointment_id, start in self.due(now))
+
+    def next_wakeup(self, now):
+        # Просыпаемся к ближайшему сроку, но не позже конца загруженного окна и очередной сверки
+        wakeup = min(self.loaded_until, self.synced_at + self.resync)
+        if self.heap:
+            wakeup = min(wakeup, self.heap[0][0])
+        return max((wakeup - now).total_seconds(), 0)
@@ -0,0 +1,79 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
+
+from .availability import invalidate_availability
+from .directory import invalidate_doctors
+from .events import doctor_channel, fanout, publish
+from .models import Appointment
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def reset_availability(sender, **kwargs):
+    invalidate_availability()
+
+
+def publish_appointment(appointment_id, doctor_id):
+    # Доктору уходит ожидающий приём целиком или сообщение, что приём ушёл из очереди.
+    # Приём перечитывается: у сохранённого экземпляра связи могут быть не загружены
+    appointment = Appointment.objects.filter(pk=appointment_id).select_related('patient').only(
+        'id', 'doctor_id', 'start_date_time', 'complaint', 'status', 'patient__first_name', 'patient__last_name'
+    ).first()
+    if appointment is None or appointment.doctor_id != doctor_id or appointment.status != Appointment.Status.PENDING:
+        publish(doctor_channel(doctor_id), 'removed', {'id': appointment_id})
+        return
+    publish(doctor_channel(doctor_id), 'appointment', {
+        'id': appointment.pk,
+        'start_date_time': timezone.localtime(appointment.start_date_time).strftime('%d-%m-%Y %H:%M:%S'),
+        'complaint': appointment.complaint,
+        'patient_first_name': appointment.patient.first_name,
+        'patient_last_name': appointment.patient.last_name,
+        'answer_url': reverse('doctor_answer', args=[appointment.pk]),
+    })
+
+
+def notify_doctors(changes):
+    # changes - пары (id приёма, id доктора). Событие уходит после фиксации транзакции,
+    # чтобы доктор не увидел откаченную запись. Массовые операции сигналов не вызывают
+    # и сообщают об изменениях сами.
+    for appointment_id, doctor_id in changes:
+        if fanout.subscribers(doctor_channel(doctor_id)):
+            transaction.on_commit(partial(publish_appointment, appointment_id, doctor_id))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def notify_doctor(sender, instance, **kwargs):
+    changes = [(instance.pk, instance.doctor_id)]
+    # Приём передан другому доктору: из очереди прежнего он уходит
+    previous_doctor_id = instance.loaded_value('doctor_id')
+    if previous_doctor_id is not None and previous_doctor_id != instance.doctor_id:
+        changes.append((instance.pk, previous_doctor_id))
+    notify_doctors(changes)
+
+
+@receiver(post_save, sender=User)
+def reset_doctors_on_user_save(sender, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login - справочник от этого не меняется
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_doctors()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(m2m_changed, sender=User.groups.through)
+def reset_doctors(sender, **kwargs):
+    if kwargs.get('action', '').startswith('pre_'):
+        return
+    invalidate_doctors()
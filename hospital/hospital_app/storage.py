@@ -0,0 +1,57 @@
+import gzip
+import posixpath
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    # Без пакета Brotli собираются только .gz-копии
+    brotli = None
+
+# Текстовые форматы; картинки PNG/JPEG уже сжаты и повторно не сжимаются
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.ico', '.txt', '.xml', '.html',
+                           '.ttf', '.otf', '.eot'}
+# Мелкие файлы не сжимаем: выигрыш меньше заголовков
+MIN_COMPRESS_SIZE = 256
+# Сжатая копия сохраняется, только если она заметно меньше исходника
+MAX_COMPRESS_RATIO = 0.9
+
+
+def compress(content):
+    # {расширение: сжатое содержимое} для вариантов, которые стоит хранить
+    variants = {'gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(content, quality=11)
+    return {extension: data for extension, data in variants.items()
+            if len(data) <= len(content) * MAX_COMPRESS_RATIO}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # collectstatic пишет имена с хешем содержимого (styles.3f2a1b9c0d4e.css) и рядом сжатые
+    # копии .gz и .br; их отдаёт hospital_app.middleware.StaticFilesMiddleware
+
+    def post_process(self, paths, dry_run=False, **options):
+        collected = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not isinstance(processed, Exception):
+                collected.update(path for path in (name, hashed_name) if path)
+        if dry_run:
+            return
+        for name in sorted(collected):
+            if posixpath.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                yield from self.compress_file(name)
+
+    def compress_file(self, name):
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        for extension, data in compress(content).items():
+            compressed_name = f'{name}.{extension}'
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(data))
+            yield name, compressed_name, True
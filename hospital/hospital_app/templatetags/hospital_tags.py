@@ -1,4 +1,11 @@
+from functools import lru_cache
+
 from django import template
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from users.roles import get_roles, DOCTOR, PATIENT
 
 register = template.Library()
 
@@ -43,3 +50,58 @@ menu_doctor = [{'title': "Ответить пациенту", 'url_name': 'docto
 @register.simple_tag
 def get_menu_doctor():
     return menu_doctor
+
+
+# Пункты меню для каждой роли поверх общего меню
+role_menus = {
+    'anonymous': [],
+    'user': [],
+    'patient': menu_patient,
+    'doctor': menu_doctor,
+    'staff': menu_doctor + menu_patient,
+}
+
+
+def menu_role(user):
+    # Роль определяется по кешированному набору групп, без запросов в шаблоне
+    if not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    roles = get_roles(user)
+    if DOCTOR in roles:
+        return 'doctor'
+    if PATIENT in roles:
+        return 'patient'
+    return 'user'
+
+
+def render_items(items, template):
+    return mark_safe(''.join(format_html(template, reverse(item['url_name']), item['title']) for item in items))
+
+
+@lru_cache(maxsize=None)
+def render_main_menu(role):
+    # Строится один раз на процесс для каждой роли: URL уже развёрнуты
+    return render_items(menu + role_menus[role], '<li><a href="{}">{}</a></li>')
+
+
+@lru_cache(maxsize=None)
+def render_left_menu():
+    return render_items(menu_left, '<p><a href="{}">{}</a></p>')
+
+
+@register.simple_tag(takes_context=True)
+def main_menu(context):
+    return render_main_menu(menu_role(context['user']))
+
+
+@register.simple_tag
+def left_menu():
+    return render_left_menu()
+
+
+@register.inclusion_tag('hospital_app/photo.html')
+def user_photo(url, sources=None):
+    # Миниатюры WebP/JPEG через srcset, если они готовы, иначе исходное фото
+    return {'url': url, 'sources': sources}
@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import pstats
+import re
+import os
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import warnings
+from io import StringIO
+from unittest.mock import patch
+from datetime import datetime, timedelta
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import connection, transaction, OperationalError
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command, CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from users.roles import get_roles
+
+from . import bulk
+from .availability import (availability_key, free_slots, get_availability, merge_intervals, CLINIC_OPENS,
+                           CLINIC_CLOSES)
+from .booking import book, SlotConflict, slot_start
+from .directory import VERSION_KEY as DIRECTORY_VERSION_KEY, get_doctors, search_doctors
+from .events import Broker, doctor_channel, fanout, publish
+from .forms import PatientNewAppointmentForm
+from .jobs import TASKS, claim, enqueue, run_job
+from .management.commands._seed import seed_appointments
+from .templatetags.hospital_tags import menu_role
+from .models import Appointment, Job, slot_for
+from .pagination import EstimatedCountPaginator
+from .metrics import DB_QUERIES, Histogram, registry
+from .middleware import accepted_encodings
+from .recurring import MAX_OCCURRENCES, book_series, expand_rule
+from .reminders import ReminderScheduler
+from .storage import brotli
+
+
+def make_user(username, group_name, **extra):
+    user = get_user_model().objects.create_user(username=username, **extra)
+    group, _ = Group.objects.get_or_create(name=group_name)
+    user.groups.add(group)
+    return user
+
+
+def next_slot(days=1):
+    start = (timezone.now() + timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    return start
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        self.other_patient = make_user('other', 'Patient')
+        self.start = next_slot()
+
+    def test_slot_roundtrip(self):
+        self.assertEqual(slot_start(slot_for(self.start)), self.start)
+
+    def test_book_sets_slot_and_end(self):
+        appointment = book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+        self.assertEqual(appointment.slot, slot_for(self.start))
+        self.assertEqual(appointment.end_date_time, self.start + timedelta(minutes=30))
+
+    def test_doctor_slot_taken(self):
+        book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+        with self.assertRaises(SlotConflict) as ctx:
+            book(Appointment(patient=self.other_patient, doctor=self.doctor, start_date_time=self.start))
+        self.assertEqual(ctx.exception.party, 'doctor')
+
+    def test_patient_slot_taken(self):
+        other_doctor = make_user('doctor2', 'Doctors')
+        book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+        with self.assertRaises(SlotConflict) as ctx:
+            book(Appointment(patient=self.patient, doctor=other_doctor, start_date_time=self.start))
+        self.assertEqual(ctx.exception.party, 'patient')
+
+    def test_adjacent_slots_allowed(self):
+        book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+        book(Appointment(patient=self.patient, doctor=self.doctor,
+                         start_date_time=self.start + timedelta(minutes=30)))
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_book_through_view(self):
+        start = self.start.replace(hour=10)
+        self.client.force_login(self.patient)
+        get_roles(self.patient)
+        get_doctors()
+        data = {'doctor': self.doctor.pk, 'start_date_time': start.strftime('%Y-%m-%dT%H:%M'),
+                'complaint': 'болит голова'}
+        # сессия, пользователь, доктор по pk с проверкой роли, проверка ForeignKey
+        # и вставка в точке сохранения
+        with self.assertNumQueries(7):
+            response = self.client.post(reverse('patient_appointment_new'), data)
+        self.assertRedirects(response, reverse('patient_appointment_new'), fetch_redirect_response=False)
+        appointment = Appointment.objects.get()
+        self.assertEqual((appointment.patient, appointment.doctor), (self.patient, self.doctor))
+
+    def test_form_rejects_non_doctor(self):
+        form = PatientNewAppointmentForm(data={
+            'doctor': self.other_patient.pk,
+            'start_date_time': self.start.replace(hour=10).strftime('%Y-%m-%dT%H:%M'),
+            'complaint': 'болит голова',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('doctor', form.errors)
+
+    def test_form_rejects_revoked_doctor_while_directory_cached(self):
+        get_doctors()
+        self.doctor.groups.clear()
+        form = PatientNewAppointmentForm(data={
+            'doctor': self.doctor.pk,
+            'start_date_time': self.start.replace(hour=10).strftime('%Y-%m-%dT%H:%M'),
+            'complaint': 'болит голова',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('doctor', form.errors)
+
+    def test_form_returns_saved_doctor(self):
+        form = PatientNewAppointmentForm(data={
+            'doctor': self.doctor.pk,
+            'start_date_time': self.start.replace(hour=10).strftime('%Y-%m-%dT%H:%M'),
+            'complaint': 'болит голова',
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['doctor'].username, self.doctor.username)
+
+    def test_form_rejects_unaligned_time(self):
+        form = PatientNewAppointmentForm(data={
+            'doctor': self.doctor.pk,
+            'start_date_time': (self.start + timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M'),
+            'complaint': 'болит голова',
+            'patient_name': 'x',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('start_date_time', form.errors)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    workers = 16
+
+    def test_parallel_bookings_single_winner(self):
+        doctor = make_user('doctor', 'Doctors')
+        patients = [make_user(f'patient{i}', 'Patient') for i in range(self.workers)]
+        start = next_slot()
+        barrier = threading.Barrier(self.workers)
+        results = []
+        lock = threading.Lock()
+
+        def attempt(patient):
+            try:
+                barrier.wait()
+                outcome = None
+                while outcome is None:
+                    try:
+                        book(Appointment(patient=patient, doctor=doctor, start_date_time=start))
+                        outcome = 'booked'
+                    except SlotConflict:
+                        outcome = 'conflict'
+                    except OperationalError:
+                        # SQLite в тестах не ждёт блокировку таблицы, а сразу сообщает о ней - повторяем
+                        pass
+                with lock:
+                    results.append(outcome)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=attempt, args=(patient,)) for patient in patients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('booked'), 1)
+        self.assertEqual(results.count('conflict'), self.workers - 1)
+        self.assertEqual(Appointment.objects.filter(doctor=doctor, slot=slot_for(start)).count(), 1)
+
+
+class StatusTests(TestCase):
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        self.start = next_slot()
+        self.appointment = book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+
+    def test_new_appointment_is_pending(self):
+        self.assertEqual(self.appointment.status, Appointment.Status.PENDING)
+
+    def test_answer_marks_answered(self):
+        self.appointment.readings = 'здоров'
+        self.appointment.save()
+        self.assertEqual(self.appointment.status, Appointment.Status.ANSWERED)
+
+    def test_cancel_frees_slot(self):
+        self.appointment.status = Appointment.Status.CANCELLED
+        self.appointment.save()
+        self.assertIsNone(self.appointment.slot)
+        other = book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.start))
+        self.assertEqual(other.slot, slot_for(self.start))
+
+    def test_preview_escaped_and_truncated(self):
+        self.appointment.readings = ' '.join(['<b>слово</b>'] * 50)
+        self.appointment.save()
+        self.assertTrue(self.appointment.readings_preview.startswith('<p>&lt;b&gt;слово'))
+        self.assertEqual(self.appointment.readings_preview.count('слово'), 40)
+
+    def test_backfill_previews(self):
+        Appointment.objects.filter(pk=self.appointment.pk).update(readings='здоров')
+        call_command('backfill_previews', stdout=StringIO())
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.readings_preview, '<p>здоров</p>')
+
+    def test_history_views_split_by_status(self):
+        answered = book(Appointment(patient=self.patient, doctor=self.doctor,
+                                    start_date_time=self.start + timedelta(hours=1), readings='здоров'))
+        self.client.force_login(self.doctor)
+        pending = self.client.get(reverse('doctor_history')).context['appointment']
+        self.assertEqual(list(pending), [self.appointment])
+        history = self.client.get(reverse('doctor_history_all')).context['appointment']
+        self.assertEqual(list(history), [answered])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        start = next_slot()
+        self.appointments = [
+            book(Appointment(patient=self.patient, doctor=self.doctor,
+                             start_date_time=start + timedelta(minutes=30 * i), readings='здоров'))
+            for i in range(45)
+        ]
+        self.client.force_login(self.doctor)
+
+    def test_walk_forward_and_back(self):
+        url = reverse('doctor_history_all')
+        response = self.client.get(url)
+        pages = [list(response.context['appointment'])]
+        self.assertFalse(response.context['page_obj'].has_previous)
+        while response.context['page_obj'].has_next:
+            response = self.client.get(url, {'after': response.context['page_obj'].next_cursor})
+            pages.append(list(response.context['appointment']))
+
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        expected = sorted(self.appointments, key=lambda a: a.start_date_time, reverse=True)
+        self.assertEqual([a for page in pages for a in page], expected)
+
+        response = self.client.get(url, {'before': response.context['page_obj'].previous_cursor})
+        self.assertEqual(list(response.context['appointment']), pages[1])
+        self.assertTrue(response.context['page_obj'].has_next)
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('doctor_history_all'), {'after': '%%%'})
+        self.assertEqual(len(response.context['appointment']), 20)
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+
+class QueryBudgetTests(TestCase):
+    # Число запросов на страницу фиксировано и не зависит от количества приёмов и врачей
+    anonymous_budgets = {
+        'home': 0, 'contact': 0, 'awards': 0, 'analyzes': 0, 'mrt': 0, 'kt': 0,
+        # doctors_all заполняет справочник докторов, availability берёт его из кеша
+        'doctors_all': 1, 'availability': 1,
+    }
+    patient_budgets = {
+        'patient_history_new': 3, 'patient_history_old': 3, 'patient_appointment_new': 2,
+    }
+    doctor_budgets = {
+        'doctor_history': 3, 'doctor_history_all': 3, 'doctor_answer': 3,
+    }
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        self.start = next_slot()
+        self.seeded = 0
+        cache.clear()
+
+    def seed(self, count):
+        # Для каждого приёма свой доктор и пациент, чтобы N+1 по связям был заметен
+        for _ in range(count):
+            self.seeded += 1
+            doctor = make_user(f'doctor{self.seeded}', 'Doctors', first_name='Доктор')
+            patient = make_user(f'patient{self.seeded}', 'Patient', last_name='Пациент')
+            start = self.start + timedelta(minutes=60 * self.seeded)
+            book(Appointment(patient=self.patient, doctor=doctor, start_date_time=start))
+            book(Appointment(patient=patient, doctor=self.doctor, start_date_time=start))
+            book(Appointment(patient=self.patient, doctor=doctor,
+                             start_date_time=start + timedelta(minutes=30), readings='здоров'))
+            book(Appointment(patient=patient, doctor=self.doctor,
+                             start_date_time=start + timedelta(minutes=30), readings='здоров'))
+
+    def assert_budgets(self, user, budgets):
+        if user is not None:
+            self.client.force_login(user)
+            # Роли уже в кеше - замеряем обычный запрос, а не первый после входа
+            get_roles(user)
+        for rows in (1, 10):
+            self.seed(rows)
+            for name, budget in budgets.items():
+                args = [Appointment.objects.filter(doctor=self.doctor).first().pk] if name == 'doctor_answer' else []
+                with self.subTest(url=name, rows=self.seeded), self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name, args=args))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_pages(self):
+        self.assert_budgets(None, self.anonymous_budgets)
+
+    def test_patient_pages(self):
+        self.assert_budgets(self.patient, self.patient_budgets)
+
+    def test_doctor_pages(self):
+        self.assert_budgets(self.doctor, self.doctor_budgets)
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        self.day = timezone.localdate() + timedelta(days=2)
+        self.opens = timezone.make_aware(datetime.combine(self.day, CLINIC_OPENS))
+        self.all_slots = int((datetime.combine(self.day, CLINIC_CLOSES)
+                              - datetime.combine(self.day, CLINIC_OPENS)) / timedelta(minutes=30))
+
+    def test_merge_intervals(self):
+        t = self.opens
+        h = timedelta(hours=1)
+        merged = merge_intervals([(t, t + h), (t + h, t + 2 * h), (t + h / 2, t + h), (t + 3 * h, t + 4 * h)])
+        self.assertEqual(merged, [[t, t + 2 * h], [t + 3 * h, t + 4 * h]])
+
+    def test_free_slots_skip_booked(self):
+        half = timedelta(minutes=30)
+        booked = [(self.opens, self.opens + half), (self.opens + 2 * half, self.opens + 4 * half)]
+        slots = free_slots(booked, self.day, self.day)
+        self.assertEqual(len(slots), self.all_slots - 3)
+        self.assertEqual(slots[0], self.opens + half)
+        self.assertEqual(slots[1], self.opens + 4 * half)
+
+    def test_endpoint_and_invalidation(self):
+        url = reverse('availability')
+        params = {'doctor': self.doctor.pk, 'date_from': self.day, 'date_to': self.day}
+        data = self.client.get(url, params).json()
+        self.assertEqual(len(data['doctors'][0]['slots']), self.all_slots)
+
+        book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.opens))
+        data = self.client.get(url, params).json()
+        self.assertEqual(len(data['doctors'][0]['slots']), self.all_slots - 1)
+
+    def test_key_length_does_not_grow_with_doctors(self):
+        date_to = self.day + timedelta(days=6)
+        # Версия - метка time_ns, докторов - сотни
+        version = 1_700_000_000_000_000_000
+        key = availability_key(version, range(1, 1000), self.day, date_to)
+        self.assertLessEqual(len(key), 250)
+        self.assertEqual(key, availability_key(version, reversed(range(1, 1000)), self.day, date_to))
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            cache.set(key, {}, 1)
+
+    def test_single_query_for_all_doctors(self):
+        doctor_ids = [self.doctor.pk] + [make_user(f'doctor{i}', 'Doctors').pk for i in range(5)]
+        book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=self.opens))
+        with self.assertNumQueries(1):
+            result = get_availability(doctor_ids, self.day, self.day + timedelta(days=6))
+        self.assertEqual(len(result), 6)
+        self.assertEqual(len(result[self.doctor.pk]), self.all_slots * 7 - 1)
+
+    def test_bad_params(self):
+        self.assertEqual(self.client.get(reverse('availability'), {'date_from': 'вчера'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('availability'), {'doctor': 999}).status_code, 404)
+
+
+class DoctorDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor', 'Doctors', first_name='Иван', cat_doctor='Терапевт')
+        make_user('patient', 'Patient')
+
+    def test_directory_cached(self):
+        self.assertEqual([doctor.label for doctor in get_doctors()], ['Терапевт Иван '])
+        with self.assertNumQueries(0):
+            get_doctors()
+            PatientNewAppointmentForm().as_p()
+
+    def test_profile_change_invalidates(self):
+        get_doctors()
+        self.doctor.last_name = 'Петров'
+        self.doctor.save()
+        self.assertEqual(get_doctors()[0].last_name, 'Петров')
+
+    def test_login_does_not_invalidate(self):
+        get_doctors()
+        self.doctor.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            get_doctors()
+
+    def test_invalidation_reaches_other_workers(self):
+        # Другой воркер - отдельный экземпляр бэкенда с теми же настройками CACHES
+        other = caches.create_connection('default')
+        get_doctors()
+        version = other.get(DIRECTORY_VERSION_KEY)
+        self.assertIsNotNone(version)
+        self.doctor.groups.clear()
+        self.assertNotEqual(other.get(DIRECTORY_VERSION_KEY), version)
+        self.assertEqual(get_doctors(), [])
+
+    def test_search_by_prefix(self):
+        make_user('doctor2', 'Doctors', first_name='Мария', last_name='Иванова', cat_doctor='Хирург')
+        make_user('doctor3', 'Doctors', first_name='Иннокентий', last_name='Смирнов', cat_doctor='Хирург')
+        self.assertEqual([d.first_name for d in search_doctors('хир')], ['Мария', 'Иннокентий'])
+        self.assertEqual([d.first_name for d in search_doctors('ив')], ['Иван', 'Мария'])
+        self.assertEqual([d.first_name for d in search_doctors('хирург ин')], ['Иннокентий'])
+        self.assertEqual(search_doctors('окулист'), [])
+
+        response = self.client.get(reverse('doctors_search'), {'q': 'тера'})
+        self.assertEqual([d['id'] for d in response.json()['doctors']], [self.doctor.pk])
+
+    def test_group_membership_invalidates(self):
+        get_doctors()
+        make_user('doctor2', 'Doctors')
+        self.assertEqual(len(get_doctors()), 2)
+        self.doctor.groups.clear()
+        self.assertEqual(len(get_doctors()), 1)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = make_user('manager', 'staff')
+        self.client.force_login(self.manager)
+
+    def test_csv_and_jsonl(self):
+        doctors, _ = seed_appointments(10, 2, 3)
+        url = reverse('appointments_export')
+
+        response = self.client.get(url, {'doctor': doctors[0].pk})
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['doctor_id'] for row in rows}, {str(doctors[0].pk)})
+        self.assertEqual(rows[0]['doctor_first_name'], 'Доктор')
+
+        response = self.client.get(url, {'format': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['patient_first_name'], 'Пациент')
+
+    def test_patient_has_no_access(self):
+        self.client.force_login(make_user('patient', 'Patient'))
+        self.assertRedirects(self.client.get(reverse('appointments_export')), reverse('home'))
+
+    def test_memory_stays_flat(self):
+        rows = 20000
+        seed_appointments(rows, 5, 50)
+        response = self.client.get(reverse('appointments_export'), {'format': 'jsonl'})
+
+        tracemalloc.start()
+        try:
+            lines = 0
+            size = 0
+            for chunk in response.streaming_content:
+                lines += 1
+                size += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, rows)
+        # Выгрузка целиком заняла бы size байт; потоковая держит в памяти только одну пачку строк
+        self.assertLess(peak, 5 * 1024 * 1024)
+        self.assertLess(peak, size / 2)
+
+
+class NavigationMenuTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_menu_per_role(self):
+        doctor = make_user('doctor', 'Doctors')
+        patient = make_user('patient', 'Patient')
+        staff = make_user('staff', 'Patient', is_staff=True)
+        self.assertEqual([menu_role(user) for user in (doctor, patient, staff)], ['doctor', 'patient', 'staff'])
+
+        for user, present, absent in [
+            (doctor, 'doctor_history_all', 'patient_history_new'),
+            (patient, 'patient_history_new', 'doctor_history_all'),
+        ]:
+            self.client.force_login(user)
+            get_roles(user)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('contact'))
+            self.assertContains(response, reverse(present))
+            self.assertNotContains(response, reverse(absent))
+
+        self.client.force_login(staff)
+        response = self.client.get(reverse('contact'))
+        self.assertContains(response, reverse('doctor_history_all'))
+        self.assertContains(response, reverse('patient_history_new'))
+
+    def test_anonymous_menu(self):
+        response = self.client.get(reverse('contact'))
+        self.assertContains(response, reverse('doctors_all'))
+        self.assertContains(response, reverse('mrt'))
+        self.assertNotContains(response, reverse('doctor_history'))
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_served_from_cache_with_conditional_get(self):
+        url = reverse('contact')
+        first = self.client.get(url)
+        self.assertTemplateUsed(first, 'hospital_app/home_contact.html')
+        self.assertTrue(first.has_header('Last-Modified'))
+
+        second = self.client.get(url)
+        self.assertEqual(second.templates, [])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_authenticated_header_not_cached(self):
+        url = reverse('home')
+        anonymous = self.client.get(url)
+        self.client.force_login(make_user('doctor', 'Doctors'))
+        response = self.client.get(url)
+        self.assertContains(response, reverse('doctor_history'))
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class AsyncViewsTests(TestCase):
+    # Async-варианты страниц отдают то же, что синхронные, и проверяют роли без синхронного ORM
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor', 'Doctors', first_name='Иван')
+        self.patient = make_user('patient', 'Patient')
+        start = next_slot()
+        self.appointments = [
+            book(Appointment(patient=self.patient, doctor=self.doctor,
+                             start_date_time=start + timedelta(minutes=30 * i)))
+            for i in range(25)
+        ]
+        self.async_client.force_login(self.doctor)
+
+    def test_views_are_async(self):
+        for name in ('async_patient_history_new', 'async_patient_history_old', 'async_doctor_history',
+                     'async_doctor_history_all', 'async_doctors_all', 'async_availability'):
+            with self.subTest(url=name):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse(name)).func))
+
+    async def test_history_pages(self):
+        response = await self.async_client.get(reverse('async_doctor_history'))
+        self.assertEqual(response.status_code, 200)
+        first = list(response.context['appointment'])
+        self.assertEqual(len(first), 20)
+        response = await self.async_client.get(reverse('async_doctor_history'),
+                                               {'after': response.context['page_obj'].next_cursor})
+        expected = sorted(self.appointments, key=lambda a: a.start_date_time, reverse=True)
+        self.assertEqual(first + list(response.context['appointment']), expected)
+        self.assertFalse(response.context['page_obj'].has_next)
+
+    async def test_role_check(self):
+        response = await self.async_client.get(reverse('async_patient_history_new'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    async def test_directory_and_availability(self):
+        response = await self.async_client.get(reverse('async_doctors_all'))
+        self.assertEqual([doctor.first_name for doctor in response.context['doctors']], ['Иван'])
+
+        day = (timezone.localdate() + timedelta(days=2)).isoformat()
+        params = {'doctor': self.doctor.pk, 'date_from': day, 'date_to': day}
+        response = await self.async_client.get(reverse('async_availability'), params)
+        expected = await sync_to_async(lambda: self.client.get(reverse('availability'), params).json())()
+        self.assertEqual(response.json(), expected)
+
+
+class DoctorEventsTests(TestCase):
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors', first_name='Иван')
+        self.patient = make_user('patient', 'Patient', first_name='Пётр')
+        self.async_client.force_login(self.doctor)
+
+    def book_and_answer(self, start):
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = book(Appointment(patient=self.patient, doctor=self.doctor,
+                                           start_date_time=start, complaint='кашель'))
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.readings = 'здоров'
+            appointment.save()
+        return appointment
+
+    async def test_stream_pushes_pending_changes(self):
+        response = await self.async_client.get(reverse('doctor_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+
+        appointment = await sync_to_async(self.book_and_answer)(next_slot())
+        added = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertIn('event: appointment', added)
+        self.assertEqual(json.loads(added.split('data: ')[1])['complaint'], 'кашель')
+        removed = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertIn('event: removed', removed)
+        self.assertEqual(json.loads(removed.split('data: ')[1]), {'id': appointment.pk})
+        await sync_to_async(response.close)()
+        self.assertEqual(fanout.subscribers(doctor_channel(self.doctor.pk)), 0)
+
+    async def test_fanout_reaches_every_worker(self):
+        workers = [fanout.attach(Broker()) for _ in range(2)]
+        try:
+            subscriptions = [worker.subscribe(doctor_channel(self.doctor.pk)) for worker in workers]
+            publish(doctor_channel(self.doctor.pk), 'removed', {'id': 1})
+            for subscription in subscriptions:
+                self.assertEqual((await subscription.get(5))[1:], ('removed', {'id': 1}))
+        finally:
+            for worker in workers:
+                fanout.detach(worker)
+
+    def test_reassign_removes_from_previous_doctor(self):
+        other_doctor = make_user('doctor2', 'Doctors')
+        start = next_slot()
+        appointments = [book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=start)),
+                        book(Appointment(patient=make_user('patient2', 'Patient'), doctor=self.doctor,
+                                         start_date_time=start + timedelta(minutes=30)))]
+        with patch.object(fanout, 'subscribers', return_value=1), \
+                patch('hospital_app.signals.publish') as published:
+            with self.captureOnCommitCallbacks(execute=True):
+                bulk.apply_batch(Appointment.objects.filter(pk=appointments[0].pk), bulk.reassign, other_doctor)
+            with self.captureOnCommitCallbacks(execute=True):
+                # Одиночное сохранение из админки
+                appointment = Appointment.objects.get(pk=appointments[1].pk)
+                appointment.doctor = other_doctor
+                appointment.save()
+        events = {(channel, event, data['id']) for channel, event, data in
+                  (call.args for call in published.call_args_list)}
+        for appointment in appointments:
+            self.assertIn((doctor_channel(self.doctor.pk), 'removed', appointment.pk), events)
+            self.assertIn((doctor_channel(other_doctor.pk), 'appointment', appointment.pk), events)
+
+    def test_without_subscribers_nothing_is_queued(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=next_slot()))
+        self.assertEqual(callbacks, [])
+
+    def test_wsgi_and_roles(self):
+        self.client.force_login(self.doctor)
+        self.assertEqual(self.client.get(reverse('doctor_events')).status_code, 204)
+        self.client.force_login(self.patient)
+        self.assertRedirects(self.client.get(reverse('doctor_events')), reverse('home'), fetch_redirect_response=False)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors', email='doctor@example.com', first_name='Иван')
+        self.patient = make_user('patient', 'Patient', email='patient@example.com', first_name='Пётр')
+
+    def test_enqueued_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                enqueue('appointment_booked', appointment_id=1)
+                raise ValueError
+            enqueue('appointment_booked', appointment_id=2)
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), [{'appointment_id': 2}])
+
+    def test_booking_and_answer_send_mail(self):
+        self.client.force_login(self.patient)
+        start = next_slot().replace(hour=10)
+        data = {'doctor': self.doctor.pk, 'start_date_time': start.strftime('%Y-%m-%dT%H:%M'),
+                'complaint': 'болит голова'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('patient_appointment_new'), data)
+        self.assertEqual(mail.outbox, [])
+        [job] = claim(10)
+        run_job(job)
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(mail.outbox[0].to, ['doctor@example.com'])
+
+        appointment = Appointment.objects.get()
+        self.client.force_login(self.doctor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('doctor_answer', args=[appointment.pk]), {'readings': 'здоров'})
+        [job] = claim(10)
+        run_job(job)
+        self.assertEqual(mail.outbox[1].to, ['patient@example.com'])
+
+    def test_retry_with_backoff_then_dead(self):
+        def broken(**kwargs):
+            raise ConnectionError('SMTP недоступен')
+
+        with patch.dict(TASKS, {'broken': broken}), self.assertLogs('hospital_app.jobs', 'WARNING'):
+            job = Job.objects.create(name='broken', max_attempts=3, run_at=timezone.now())
+            delays = []
+            for _ in range(3):
+                [job] = claim(10)
+                before = timezone.now()
+                run_job(job)
+                delays.append((job.run_at - before).total_seconds())
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DEAD)
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('SMTP недоступен', job.last_error)
+        self.assertLess(delays[0], delays[1])
+        self.assertEqual(claim(10), [])
+
+    def test_stale_running_job_is_requeued(self):
+        job = Job.objects.create(name='appointment_booked', payload={'appointment_id': 0}, run_at=timezone.now(),
+                                 status=Job.Status.RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim(10), [job])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.RUNNING, 1))
+
+    def test_job_that_kills_worker_becomes_dead(self):
+        job = Job.objects.create(name='appointment_booked', payload={'appointment_id': 0}, run_at=timezone.now(),
+                                 max_attempts=2)
+        for _ in range(2):
+            # Воркер забрал задачу и погиб, не дойдя до run_job
+            self.assertEqual(claim(10), [job])
+            Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim(10), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.DEAD, 2))
+        self.assertIsNotNone(job.finished_at)
+
+
+class JobWorkerTests(TransactionTestCase):
+    def test_each_job_runs_once(self):
+        done = []
+        lock = threading.Lock()
+
+        def record(number):
+            with lock:
+                done.append(number)
+
+        with patch.dict(TASKS, {'record': record}):
+            Job.objects.bulk_create(
+                Job(name='record', payload={'number': i}, run_at=timezone.now()) for i in range(20)
+            )
+            call_command('run_worker', threads=4, once=True, stdout=StringIO())
+
+        self.assertEqual(sorted(done), list(range(20)))
+        self.assertEqual(Job.objects.filter(status=Job.Status.DONE).count(), 20)
+
+
+class ReminderTests(TestCase):
+    lead = timedelta(hours=24)
+
+    def setUp(self):
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient', email='patient@example.com')
+        self.now = timezone.now()
+
+    def appointment(self, hours, **extra):
+        start = (self.now + timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+        return book(Appointment(patient=self.patient, doctor=self.doctor, start_date_time=start, **extra))
+
+    def run_scheduler(self, scheduler, now):
+        with self.captureOnCommitCallbacks(execute=True):
+            return scheduler.run_once(now)
+
+    def test_only_due_reminders_are_sent(self):
+        due = self.appointment(23)
+        self.appointment(26)
+        self.appointment(72)
+        self.appointment(22, status=Appointment.Status.CANCELLED)
+        self.assertEqual(self.run_scheduler(ReminderScheduler(self.lead), self.now), 1)
+        self.assertEqual(list(Appointment.objects.exclude(reminder_sent_at=None)), [due])
+        self.assertEqual(Job.objects.get().payload, {'appointment_id': due.pk})
+
+    def test_window_moves_with_time(self):
+        later = self.appointment(26)
+        scheduler = ReminderScheduler(self.lead, resync=timedelta(days=1))
+        self.assertEqual(self.run_scheduler(scheduler, self.now), 0)
+        self.assertEqual(scheduler.heap, [])
+        # Часы прыгнули вперёд сразу на три часа: полоса между окнами всё равно загружается
+        self.assertEqual(self.run_scheduler(scheduler, self.now + timedelta(hours=3)), 1)
+        later.refresh_from_db()
+        self.assertIsNotNone(later.reminder_sent_at)
+
+    def test_restart_and_clock_drift_do_not_resend(self):
+        self.appointment(23)
+        scheduler = ReminderScheduler(self.lead)
+        self.assertEqual(self.run_scheduler(scheduler, self.now), 1)
+        self.assertEqual(self.run_scheduler(scheduler, self.now - timedelta(hours=1)), 0)
+        self.assertEqual(self.run_scheduler(ReminderScheduler(self.lead), self.now), 0)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_late_booking_found_on_resync(self):
+        scheduler = ReminderScheduler(self.lead, resync=timedelta(minutes=5))
+        self.run_scheduler(scheduler, self.now)
+        late = self.appointment(5)
+        self.assertEqual(self.run_scheduler(scheduler, self.now + timedelta(minutes=1)), 0)
+        self.assertEqual(self.run_scheduler(scheduler, self.now + timedelta(minutes=6)), 1)
+        self.assertEqual(Job.objects.get().payload, {'appointment_id': late.pk})
+
+    def test_reminder_mail(self):
+        appointment = self.appointment(23)
+        self.run_scheduler(ReminderScheduler(self.lead), self.now)
+        [job] = claim(10)
+        run_job(job)
+        self.assertEqual(mail.outbox[0].to, ['patient@example.com'])
+        self.assertIn(timezone.localtime(appointment.start_date_time).strftime('%d-%m-%Y %H:%M'), mail.outbox[0].body)
+
+    def test_rescheduled_appointment_reminded_again(self):
+        moved, shifted = self.appointment(23), self.appointment(22)
+        self.assertEqual(self.run_scheduler(ReminderScheduler(self.lead), self.now), 2)
+
+        # Перенос в админке (save) и массовым сдвигом (bulk_update)
+        appointment = Appointment.objects.get(pk=moved.pk)
+        appointment.save()
+        self.assertIsNotNone(appointment.reminder_sent_at)
+        appointment.start_date_time += timedelta(days=1)
+        appointment.save()
+        bulk.apply_batch(Appointment.objects.filter(pk=shifted.pk), bulk.shift, timedelta(days=1))
+        self.assertEqual(Appointment.objects.filter(reminder_sent_at=None).count(), 2)
+
+        self.assertEqual(self.run_scheduler(ReminderScheduler(self.lead), self.now + timedelta(days=1)), 2)
+        self.assertEqual(Job.objects.count(), 4)
+
+
+class RecurringBookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.doctor = make_user('doctor', 'Doctors')
+        self.patient = make_user('patient', 'Patient')
+        day = timezone.localdate() + timedelta(days=2)
+        self.start = timezone.make_aware(datetime.combine(day, CLINIC_OPENS)) + timedelta(hours=1)
+
+    def week(self, n):
+        return self.start + timedelta(weeks=n)
+
+    def test_expand_rule(self):
+        self.assertEqual(expand_rule(self.start, 'weekly', count=13)[-1], self.week(12))
+        self.assertEqual(len(expand_rule(self.start, 'daily', 2, until=(self.start + timedelta(days=9)).date())), 5)
+        self.assertEqual(len(expand_rule(self.start, 'daily', count=1000)), MAX_OCCURRENCES)
+
+    def test_conflicts_checked_in_one_query(self):
+        other_doctor = make_user('doctor2', 'Doctors')
+        other_patient = make_user('patient2', 'Patient')
+        book(Appointment(patient=other_patient, doctor=self.doctor, start_date_time=self.week(3)))
+        book(Appointment(patient=self.patient, doctor=other_doctor, start_date_time=self.week(5)))
+        get_availability([self.doctor.pk], self.week(7).date(), self.week(7).date())
+
+        starts = expand_rule(self.start, 'weekly', count=12) + [self.start - timedelta(days=10)]
+        with self.assertNumQueries(6):
+            # выборка занятого времени, вставка одним INSERT в точке сохранения внутри транзакции серии
+            results = book_series(self.patient, self.doctor, starts, 'осмотр')
+
+        statuses = [result['status'] for result in results]
+        self.assertEqual(statuses.count('booked'), 10)
+        self.assertEqual(results[0]['status'], 'invalid')
+        self.assertEqual(results[4]['message'], SlotConflict.messages['doctor'])
+        self.assertEqual(results[6]['message'], SlotConflict.messages['patient'])
+
+        created = Appointment.objects.filter(doctor=self.doctor, patient=self.patient)
+        self.assertEqual(sorted(created.values_list('id', flat=True)),
+                         sorted(result['id'] for result in results if result['status'] == 'booked'))
+        for appointment in created:
+            self.assertEqual(appointment.slot, slot_for(appointment.start_date_time))
+            self.assertEqual(appointment.end_date_time, appointment.start_date_time + timedelta(minutes=30))
+            self.assertEqual(appointment.status, Appointment.Status.PENDING)
+        # Кеш свободного времени сброшен, хотя сигналы при массовой вставке не срабатывают
+        free = get_availability([self.doctor.pk], self.week(7).date(), self.week(7).date())[self.doctor.pk]
+        self.assertNotIn(self.week(7), free)
+
+    def test_race_falls_back_to_single_inserts(self):
+        book(Appointment(patient=make_user('patient2', 'Patient'), doctor=self.doctor, start_date_time=self.week(1)))
+        with patch('hospital_app.recurring.busy_intervals', return_value=([], [])):
+            results = book_series(self.patient, self.doctor, expand_rule(self.start, 'weekly', count=3))
+        self.assertEqual([result['status'] for result in results], ['booked', 'conflict', 'booked'])
+
+    def test_race_fallback_rolls_back_whole_series(self):
+        book(Appointment(patient=make_user('patient2', 'Patient'), doctor=self.doctor, start_date_time=self.week(1)))
+        booked = []
+
+        def book_or_fail(appointment):
+            # Третья вставка падает не из-за занятого слота - серия не должна остаться записанной частично
+            if len(booked) == 2:
+                raise OperationalError('соединение потеряно')
+            booked.append(appointment)
+            return book(appointment)
+
+        with patch('hospital_app.recurring.busy_intervals', return_value=([], [])), \
+                patch('hospital_app.recurring.book', side_effect=book_or_fail), \
+                self.assertRaises(OperationalError):
+            book_series(self.patient, self.doctor, expand_rule(self.start, 'weekly', count=3))
+        self.assertFalse(Appointment.objects.filter(patient=self.patient).exists())
+
+    def test_endpoint(self):
+        url = reverse('patient_appointment_series')
+        data = {'doctor': self.doctor.pk, 'start_date_time': self.start.strftime('%Y-%m-%dT%H:%M'),
+                'frequency': 'weekly', 'count': 13}
+        self.client.force_login(self.patient)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['booked'], 13)
+        self.assertEqual(Job.objects.get().name, 'appointments_booked')
+
+        self.assertEqual(self.client.post(url, data).status_code, 409)
+        self.assertEqual(self.client.post(url, dict(data, count='')).status_code, 400)
+        self.client.force_login(self.doctor)
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+
+
+class AdminChangelistTests(TestCase):
+    # Число запросов списка приёмов в админке не зависит от числа строк и пользователей
+    budget = 6
+
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_user('admin', is_staff=True, is_superuser=True)
+        self.start = next_slot()
+        self.seeded = 0
+        self.client.force_login(self.admin)
+
+    def seed(self, count):
+        for _ in range(count):
+            self.seeded += 1
+            doctor = make_user(f'doctor{self.seeded}', 'Doctors', last_name=f'Доктор{self.seeded}')
+            patient = make_user(f'patient{self.seeded}', 'Patient', last_name=f'Пациент{self.seeded}')
+            book(Appointment(patient=patient, doctor=doctor,
+                             start_date_time=self.start + timedelta(minutes=30 * self.seeded)))
+
+    def test_changelist_query_budget(self):
+        url = reverse('admin:hospital_app_appointment_changelist')
+        for rows in (2, 30):
+            self.seed(rows)
+            for params in ({}, {'doctor': 'Доктор1'}, {'patient': str(self.seeded)}):
+                with self.subTest(rows=self.seeded, params=params), self.assertNumQueries(self.budget):
+                    response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+            # Пользователи в боковую панель не выводятся
+            self.assertNotContains(response, 'patient__id__exact')
+
+    def test_filters(self):
+        self.seed(3)
+        url = reverse('admin:hospital_app_appointment_changelist')
+        self.assertEqual(self.client.get(url, {'doctor': 'Доктор2'}).context['cl'].result_count, 1)
+        self.assertEqual(self.client.get(url, {'patient': 'нет'}).context['cl'].result_count, 0)
+
+    def test_estimated_count_for_unfiltered_list(self):
+        self.seed(3)
+        with patch('hospital_app.pagination.estimated_count', return_value=1000):
+            self.assertEqual(EstimatedCountPaginator(Appointment.objects.all(), 20).count, 1000)
+            self.assertEqual(EstimatedCountPaginator(Appointment.objects.filter(doctor__last_name='Доктор1'), 20).count, 1)
+
+    def test_autocomplete_limited_to_role(self):
+        self.seed(1)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'hospital_app', 'model_name': 'appointment', 'field_name': 'doctor', 'term': '',
+        })
+        self.assertEqual([item['text'] for item in response.json()['results']], ['doctor1'])
+
+    def test_add_form_checks_slot(self):
+        self.seed(1)
+        taken = Appointment.objects.get()
+        other_patient = make_user('patient2', 'Patient')
+        url = reverse('admin:hospital_app_appointment_add')
+        local = timezone.localtime(taken.start_date_time)
+        data = {'doctor': taken.doctor_id, 'patient': other_patient.pk, 'complaint': '', 'readings': '',
+                'start_date_time_0': local.strftime('%Y-%m-%d'), 'start_date_time_1': local.strftime('%H:%M:%S'),
+                'end_date_time_0': '', 'end_date_time_1': '', 'status': Appointment.Status.PENDING}
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'В это время у доктора уже есть приём.')
+        self.assertNotContains(response, 'успешно')
+
+        off_grid = local + timedelta(minutes=10)
+        response = self.client.post(url, dict(data, start_date_time_1=off_grid.strftime('%H:%M:%S')))
+        self.assertFormError(response.context['adminform'].form, 'start_date_time',
+                             'Время приёма должно быть кратно 30 минутам.')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        free = local + timedelta(minutes=30)
+        response = self.client.post(url, dict(data, start_date_time_1=free.strftime('%H:%M:%S')))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+    def test_concurrent_booking_reported(self):
+        self.seed(1)
+        taken = Appointment.objects.get()
+        url = reverse('admin:hospital_app_appointment_add')
+        free = timezone.localtime(taken.start_date_time) + timedelta(minutes=30)
+        data = {'doctor': taken.doctor_id, 'patient': taken.patient_id, 'complaint': '', 'readings': '',
+                'start_date_time_0': free.strftime('%Y-%m-%d'), 'start_date_time_1': free.strftime('%H:%M:%S'),
+                'end_date_time_0': '', 'end_date_time_1': '', 'status': Appointment.Status.PENDING}
+        # Форма прошла проверку, но слот занял параллельный запрос до сохранения
+        with patch('hospital_app.admin.book', side_effect=SlotConflict('doctor')):
+            response = self.client.post(url, data)
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ['В это время у доктора уже есть приём.'])
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertFalse(LogEntry.objects.exists())
+
+
+class BulkChangeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_user('admin', is_staff=True, is_superuser=True)
+        self.doctor = make_user('doctor', 'Doctors')
+        self.other_doctor = make_user('doctor2', 'Doctors')
+        self.patients = [make_user(f'patient{i}', 'Patient') for i in range(4)]
+        day = timezone.localdate() + timedelta(days=2)
+        self.start = timezone.make_aware(datetime.combine(day, CLINIC_OPENS)) + timedelta(hours=1)
+        # Приёмы доктора подряд: каждые 30 минут
+        self.day = [book(Appointment(patient=patient, doctor=self.doctor, start_date_time=self.at(i)))
+                    for i, patient in enumerate(self.patients)]
+
+    def at(self, n):
+        return self.start + timedelta(minutes=30 * n)
+
+    def starts(self):
+        return list(Appointment.objects.filter(doctor=self.doctor).order_by('pk').values_list('start_date_time',
+                                                                                             flat=True))
+
+    def test_shift_consecutive_appointments(self):
+        get_availability([self.doctor.pk], self.start.date(), self.start.date())
+        count = bulk.apply_batch(Appointment.objects.filter(doctor=self.doctor), bulk.shift, timedelta(minutes=30))
+        self.assertEqual(count, 4)
+        self.assertEqual(self.starts(), [self.at(i) for i in range(1, 5)])
+        appointment = Appointment.objects.get(pk=self.day[-1].pk)
+        self.assertEqual(appointment.slot, slot_for(self.at(4)))
+        self.assertEqual(appointment.end_date_time, self.at(5))
+        # Кеш свободных слотов сброшен
+        free = get_availability([self.doctor.pk], self.start.date(), self.start.date())[self.doctor.pk]
+        self.assertIn(self.at(0), free)
+        self.assertNotIn(self.at(4), free)
+
+    def test_conflict_aborts_whole_batch(self):
+        outsider = make_user('outsider', 'Patient')
+        book(Appointment(patient=outsider, doctor=self.doctor, start_date_time=self.at(5)))
+        with self.assertRaises(bulk.BatchConflict) as raised:
+            bulk.apply_batch(Appointment.objects.filter(pk__in=[a.pk for a in self.day]), bulk.shift,
+                             timedelta(minutes=60))
+        self.assertEqual([appointment.pk for appointment, _ in raised.exception.conflicts], [self.day[3].pk])
+        self.assertEqual(self.starts()[:4], [self.at(i) for i in range(4)])
+
+    def test_conflicts_checked_in_one_query(self):
+        appointments = list(Appointment.objects.filter(doctor=self.doctor))
+        for appointment in appointments:
+            bulk.reassign(appointment, self.other_doctor)
+        with self.assertNumQueries(1):
+            self.assertEqual(bulk.find_conflicts(appointments), [])
+        # Два приёма пачки на одном слоте - конфликт внутри пачки
+        bulk.shift(appointments[1], timedelta(minutes=-30))
+        self.assertEqual(len(bulk.find_conflicts(appointments)), 1)
+
+    def test_reassign_close_and_cancel(self):
+        first, second = self.day[:2]
+        bulk.apply_batch(Appointment.objects.filter(pk=first.pk), bulk.reassign, self.other_doctor)
+        bulk.apply_batch(Appointment.objects.filter(pk=second.pk), bulk.close, 'Здоров')
+        bulk.apply_batch(Appointment.objects.filter(pk=self.day[2].pk), bulk.cancel)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        cancelled = Appointment.objects.get(pk=self.day[2].pk)
+        self.assertEqual(first.doctor, self.other_doctor)
+        self.assertEqual((second.status, second.readings_preview), (Appointment.Status.ANSWERED, '<p>Здоров</p>'))
+        self.assertEqual((cancelled.status, cancelled.slot), (Appointment.Status.CANCELLED, None))
+
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:hospital_app_appointment_changelist')
+        data = {'action': 'shift_appointments', '_selected_action': [a.pk for a in self.day]}
+        response = self.client.post(url, data)
+        self.assertTemplateUsed(response, 'admin/hospital_app/appointment_batch.html')
+        self.assertEqual(self.starts(), [self.at(i) for i in range(4)])
+
+        response = self.client.post(url, {**data, 'apply': '1', 'days': 1, 'minutes': 0})
+        self.assertRedirects(response, url)
+        self.assertEqual(self.starts(), [self.at(i) + timedelta(days=1) for i in range(4)])
+
+        response = self.client.post(url, {**data, 'apply': '1', 'days': 0, 'minutes': 15})
+        self.assertContains(response, 'кратен')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('bulk_appointments', 'reassign', '--doctor', str(self.doctor.pk),
+                     '--date', self.start.date().isoformat(), '--to', str(self.other_doctor.pk), stdout=out)
+        self.assertIn('4', out.getvalue())
+        self.assertEqual(Appointment.objects.filter(doctor=self.other_doctor).count(), 4)
+
+        book(Appointment(patient=make_user('outsider', 'Patient'), doctor=self.doctor, start_date_time=self.at(0)))
+        with self.assertRaises(CommandError):
+            call_command('bulk_appointments', 'reassign', '--ids', str(self.day[0].pk), '--to', str(self.doctor.pk))
+
+
+class StaticAssetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.root)
+        settings = override_settings(STATIC_ROOT=cls.root, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'hospital_app.storage.CompressedManifestStaticFilesStorage'},
+        })
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(f'{cls.root}/staticfiles.json', encoding='utf-8') as file:
+            cls.hashed = json.load(file)['paths']['hospital_app/css/styles.css']
+        cls.url = f'/static/{cls.hashed}'
+
+    def read(self, name):
+        with open(f'{self.root}/{name}', 'rb') as file:
+            return file.read()
+
+    def test_precompressed_copies_are_smaller(self):
+        original = self.read(self.hashed)
+        compressed = self.read(self.hashed + '.gz')
+        self.assertEqual(gzip.decompress(compressed), original)
+        self.assertLess(len(compressed), len(original) * 0.5)
+        if brotli is not None:
+            self.assertLessEqual(len(self.read(self.hashed + '.br')), len(compressed))
+        # Картинки уже сжаты - копий нет
+        self.assertFalse(any(name.endswith('.png.gz') for name in os.listdir(f'{self.root}/hospital_app/images')))
+
+    def test_pages_link_hashed_names(self):
+        self.assertContains(self.client.get(reverse('home')), self.url)
+
+    def test_serves_gzip_variant(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate, br;q=0')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(gzip.decompress(body), self.read(self.hashed))
+
+    def test_identity_and_unhashed_names(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), self.read(self.hashed))
+        response = self.client.get('/static/hospital_app/css/styles.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.client.get('/static/hospital_app/css/missing.css').status_code, 404)
+
+    def test_not_modified(self):
+        first = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Cache-Control'], first['Cache-Control'])
+        # ETag сжатой копии не подходит к несжатому ответу
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, BR , identity;q=0'), {'gzip', 'br'})
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.files = {
+            'photos/building.jpg': b'0123456789',
+            'users/2024/01/31/doctor.jpg': b'doctor photo',
+            'users/2024/01/31/thumbs/doctor.jpg_200.webp': b'doctor thumbnail',
+            'users/2024/01/31/patient.jpg': b'patient photo',
+            'users/2024/01/31/thumbs/patient.jpg_200.webp': b'patient thumbnail',
+            # Доктор и пациент загрузили в один день файлы с одинаковым именем без расширения
+            'users/2024/01/31/photo.png': b'doctor photo',
+            'users/2024/01/31/thumbs/photo.png_200.webp': b'doctor thumbnail',
+            'users/2024/01/31/photo.jpg': b'patient photo',
+            'users/2024/01/31/thumbs/photo.jpg_200.webp': b'patient thumbnail',
+        }
+        for name, content in self.files.items():
+            os.makedirs(os.path.dirname(f'{root}/{name}'), exist_ok=True)
+            with open(f'{root}/{name}', 'wb') as file:
+                file.write(content)
+        self.root = root
+        make_user('doctor', 'Doctors', photo='users/2024/01/31/doctor.jpg')
+        self.patient = make_user('patient', 'Patient', photo='users/2024/01/31/patient.jpg')
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', **headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_directory_not_found(self):
+        self.assertEqual(self.get('photos/').status_code, 404)
+        self.assertEqual(self.get('photos').status_code, 404)
+
+    def test_public_file_and_not_modified(self):
+        response = self.get('photos/building.jpg')
+        self.assertEqual(self.body(response), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get('photos/building.jpg', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_ranges(self):
+        name = 'photos/building.jpg'
+        response = self.get(name, HTTP_RANGE='bytes=2-5')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 2-5/10'))
+        self.assertEqual((self.body(response), response['Content-Length']), (b'2345', '4'))
+        self.assertEqual(self.body(self.get(name, HTTP_RANGE='bytes=7-')), b'789')
+        self.assertEqual(self.body(self.get(name, HTTP_RANGE='bytes=-3')), b'789')
+        self.assertEqual(self.body(self.get(name, HTTP_RANGE='bytes=8-100')), b'89')
+        response = self.get(name, HTTP_RANGE='bytes=10-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        # Несколько диапазонов и устаревший If-Range - файл целиком
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=0-1,4-5').status_code, 200)
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_user_photos_access(self):
+        for name in ('users/2024/01/31/doctor.jpg', 'users/2024/01/31/thumbs/doctor.jpg_200.webp'):
+            self.assertEqual(self.get(name).status_code, 200)
+        patient_photo = 'users/2024/01/31/thumbs/patient.jpg_200.webp'
+        self.assertEqual(self.get(patient_photo).status_code, 404)
+        self.client.force_login(make_user('other', 'Patient'))
+        self.assertEqual(self.get(patient_photo).status_code, 404)
+        self.client.force_login(self.patient)
+        response = self.get(patient_photo)
+        self.assertEqual(self.body(response), b'patient thumbnail')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3600')
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.get(patient_photo).status_code, 200)
+
+    def test_same_stem_photos_not_shared(self):
+        make_user('doctor2', 'Doctors', photo='users/2024/01/31/photo.png')
+        make_user('patient2', 'Patient', photo='users/2024/01/31/photo.jpg')
+        for name in ('users/2024/01/31/photo.png', 'users/2024/01/31/thumbs/photo.png_200.webp'):
+            self.assertEqual(self.get(name)['Cache-Control'], 'public, max-age=3600')
+        for name in ('users/2024/01/31/photo.jpg', 'users/2024/01/31/thumbs/photo.jpg_200.webp'):
+            self.assertEqual(self.get(name).status_code, 404)
+
+    def test_missing_and_outside_files(self):
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.get('photos/missing.jpg').status_code, 404)
+        self.assertEqual(self.get('../manage.py').status_code, 404)
+        self.assertEqual(self.get('photos/%2E%2E/%2E%2E/manage.py').status_code, 404)
+
+    def test_offloaded_transfer(self):
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get('photos/building.jpg')
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photos/building.jpg')
+            self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.get('users/2024/01/31/doctor.jpg')
+            self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'users/2024/01/31/doctor.jpg'))
+        self.assertEqual(self.get('users/2024/01/31/patient.jpg').status_code, 404)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.patient = make_user('patient', 'Patient')
+        self.admin = get_user_model().objects.create_user('admin', is_staff=True)
+
+    def metrics(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_views_from_both_urlconfs(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('users:login'))
+        self.client.get('/missing-page/')
+        text = self.metrics()
+        self.assertIn('hospital_http_requests_total{view="home",method="GET",status="200"} 1', text)
+        self.assertIn('hospital_http_requests_total{view="users:login",method="GET",status="200"} 1', text)
+        self.assertIn('hospital_http_requests_total{view="<unmatched>",method="GET",status="404"} 1', text)
+        self.assertIn('hospital_http_request_duration_seconds_count{view="home"} 1', text)
+        self.assertIn('hospital_template_render_seconds_count{view="users:login"} 1', text)
+        self.assertIn('# TYPE hospital_db_queries_per_request histogram', text)
+
+    def test_query_count_matches_database(self):
+        self.client.force_login(self.patient)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('patient_history_new'))
+        series = DB_QUERIES.values[('patient_history_new',)]
+        self.assertEqual(series[-1], len(queries))
+        self.assertIn(f'hospital_db_queries_per_request_sum{{view="patient_history_new"}} {len(queries)}',
+                      self.metrics())
+
+    async def test_async_views_counted(self):
+        await self.async_client.get(reverse('async_doctors_all'))
+        self.assertGreater(DB_QUERIES.values[('async_doctors_all',)][-1], 0)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_histogram_format(self):
+        histogram = Histogram('latency', 'Задержка', ('view',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(('a"b',), value)
+        self.assertEqual(list(histogram.samples()), [
+            'latency_bucket{view="a\\"b",le="0.1"} 2',
+            'latency_bucket{view="a\\"b",le="1.0"} 3',
+            'latency_bucket{view="a\\"b",le="+Inf"} 4',
+            'latency_sum{view="a\\"b"} 3.65',
+            'latency_count{view="a\\"b"} 4',
+        ])
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(PROFILING_DIR=self.directory, PROFILING_KEEP=3)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.admin = get_user_model().objects.create_user('admin', is_staff=True)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_off_by_default(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('home'), HTTP_X_PROFILE='prof')
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(PROFILING_HEADER='X-Profile')
+    def test_staff_header(self):
+        self.client.force_login(make_user('patient', 'Patient'))
+        self.client.get(reverse('home'), HTTP_X_PROFILE='prof')
+        self.assertEqual(self.profiles(), [])
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('doctors_all'), HTTP_X_PROFILE='prof')
+        self.assertEqual(self.profiles(), [response['X-Profile']])
+        self.assertRegex(response['X-Profile'], r'-doctors_all-\d+ms-[0-9a-f]{8}\.prof$')
+        stats = pstats.Stats(os.path.join(self.directory, response['X-Profile']))
+        self.assertTrue(any(name == 'get_queryset' for _, _, name in stats.stats))
+
+        response = self.client.get(reverse('users:login'), HTTP_X_PROFILE='collapsed')
+        with open(os.path.join(self.directory, response['X-Profile']), encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(re.fullmatch(r'.+ \d+', line) for line in lines))
+        self.assertTrue(any(';_get_response (base.py:' in line and ';view (base.py:' in line for line in lines))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_sampling_and_rotation(self):
+        for _ in range(5):
+            response = self.client.get(reverse('users:login'))
+        # Случайно выбранный запрос имя профиля не получает
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(len(self.profiles()), 3)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_admin_pages(self):
+        self.client.get(reverse('users:login'))
+        name = self.profiles()[0]
+        self.assertEqual(self.client.get(reverse('admin_profiles')).status_code, 302)
+
+        self.client.force_login(get_user_model().objects.create_user('root', is_staff=True, is_superuser=True))
+        self.assertContains(self.client.get(reverse('admin_profiles')), reverse('admin_profile_download', args=[name]))
+        response = self.client.get(reverse('admin_profile_download', args=[name]))
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{name}"')
+        self.assertEqual(self.client.get(reverse('admin_profile_download', args=['..%2Fmanage.py'])).status_code, 404)
@@ -9,12 +9,27 @@ urlpatterns = [
     path('patient_history_new/', views.PatientNewListView.as_view(), name='patient_history_new'),
     path('patient_history_old/', views.PatientOldListView.as_view(), name='patient_history_old'),
     path('patient_appointment_new/', views.PatientNewAppointmentView.as_view(), name='patient_appointment_new'),
+    path('patient_appointment_series/', views.RecurringAppointmentView.as_view(), name='patient_appointment_series'),
+    path('availability/', views.AvailabilityView.as_view(), name='availability'),
 
     path('doctors_all/', views.DoctorListView.as_view(), name='doctors_all'),
+    path('doctors_search/', views.DoctorSearchView.as_view(), name='doctors_search'),
     path('doctor_history/', views.DoctorHistoryListView.as_view(), name='doctor_history'),
     path('doctor_history_all/', views.DoctorAllHistoryListView.as_view(), name='doctor_history_all'),
+    path('doctor_events/', views.DoctorEventsView.as_view(), name='doctor_events'),
     path('doctor_answer/<int:appointment_id>/', views.DoctorAnswerView.as_view(), name='doctor_answer'),
 
+    path('export/', views.AppointmentExportView.as_view(), name='appointments_export'),
+
+    # Те же страницы для ASGI: обработчики async и не занимают поток на время запросов к БД
+    path('async/patient_history_new/', views.AsyncPatientNewListView.as_view(), name='async_patient_history_new'),
+    path('async/patient_history_old/', views.AsyncPatientOldListView.as_view(), name='async_patient_history_old'),
+    path('async/doctor_history/', views.AsyncDoctorHistoryListView.as_view(), name='async_doctor_history'),
+    path('async/doctor_history_all/', views.AsyncDoctorAllHistoryListView.as_view(),
+         name='async_doctor_history_all'),
+    path('async/doctors_all/', views.AsyncDoctorListView.as_view(), name='async_doctors_all'),
+    path('async/availability/', views.AsyncAvailabilityView.as_view(), name='async_availability'),
+
     path('analyzes/', views.TagsAnalizeView.as_view(), name='analyzes'),
     path('mrt/', views.TagsMrtView.as_view(), name='mrt'),
     path('kt/', views.TagsKtView.as_view(), name='kt'),
@@ -1,17 +1,41 @@
+import hmac
+from datetime import date, timedelta
+
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.mixins import UserPassesTestMixin
-from django.http import HttpResponseNotFound
-from django.shortcuts import render, redirect
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (Http404, HttpResponse, HttpResponseNotFound, HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic import ListView, CreateView, UpdateView
 from django.utils import timezone
 from django.db.models import Q
+from users.mixins import AsyncRoleRequiredMixin, RoleRequiredMixin
 from users.models import User
-from datetime import timedelta
+from users.roles import PATIENT, DOCTOR, STAFF, ROOT
+from .availability import aget_availability, get_availability, MAX_RANGE_DAYS
+from .booking import book, SlotConflict
+from .caching import CachedPageMixin
+from .directory import aget_doctors, get_doctors, search_doctors
+from .events import broker, doctor_channel, EventStreamResponse
+from .export import export_lines, export_queryset, CONTENT_TYPES
+from .jobs import enqueue
+from .media import media_access, serve_media
+from .metrics import registry
 from .models import Appointment
-from .forms import PatientNewAppointmentForm, DoctorAnswerForm
+from .pagination import KeysetPaginationMixin
+from .forms import PatientNewAppointmentForm, DoctorAnswerForm, RecurringAppointmentForm
+from .recurring import book_series
 
+# Поля, которые выводят шаблоны истории; остальные колонки приёма и пользователей не читаются
+HISTORY_FIELDS = [
+    'id', 'start_date_time', 'complaint', 'readings_preview',
+    'doctor__first_name', 'doctor__last_name', 'doctor__photo', 'doctor__has_thumbnails',
+    'patient__first_name', 'patient__last_name',
+]
 
 
 
@@ -19,7 +43,7 @@ def page_not_found(request, exception):
     return HttpResponseNotFound("<h1>Страница не найдена</h1>")
 
 
-class HomeView(View):
+class HomeView(CachedPageMixin, View):
     template_name = 'hospital_app/home.html'
 
     def get(self, request, *args, **kwargs):
@@ -29,7 +53,7 @@ class HomeView(View):
         return render(request, self.template_name, context=context)
 
 
-class ContactView(View):
+class ContactView(CachedPageMixin, View):
     template_name = 'hospital_app/home_contact.html'
 
     def get(self, request, *args, **kwargs):
@@ -39,7 +63,7 @@ class ContactView(View):
         return render(request, self.template_name, context=context)
 
 
-class AwardsView(View):
+class AwardsView(CachedPageMixin, View):
     template_name = 'hospital_app/home_awards.html'
 
     def get(self, request, *args, **kwargs):
@@ -63,28 +87,82 @@ class DoctorListView(ListView):
         return context
 
     def get_queryset(self):
-        # Получаем докторов из группы Doctors
+        # Получаем докторов из группы Doctors (из кешированного справочника)
+        return get_doctors()
+
+
+# свободные слоты докторов за период
+class AvailabilityView(View):
+    default_range_days = 7
+
+    def get(self, request, *args, **kwargs):
+        query = self.parse_query(request, get_doctors())
+        if isinstance(query, JsonResponse):
+            return query
+        doctor_ids, date_from, date_to = query
+        return self.render_availability(date_from, date_to, get_availability(doctor_ids, date_from, date_to))
+
+    def parse_query(self, request, doctors):
+        # (doctor_ids, date_from, date_to) или ответ с ошибкой
+        try:
+            date_from = date.fromisoformat(request.GET['date_from']) if 'date_from' in request.GET \
+                else timezone.localdate()
+            date_to = date.fromisoformat(request.GET['date_to']) if 'date_to' in request.GET \
+                else date_from + timedelta(days=self.default_range_days - 1)
+            doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+        except ValueError:
+            return JsonResponse({'error': 'Неверные параметры запроса'}, status=400)
+
+        if date_to < date_from or (date_to - date_from).days >= MAX_RANGE_DAYS:
+            return JsonResponse({'error': f'Период должен быть от 1 до {MAX_RANGE_DAYS} дней'}, status=400)
+
+        doctor_ids = [doctor.id for doctor in doctors]
+        if doctor_id is not None:
+            doctor_ids = [pk for pk in doctor_ids if pk == doctor_id]
+        if doctor_id is not None and not doctor_ids:
+            return JsonResponse({'error': 'Доктор не найден'}, status=404)
+        return doctor_ids, date_from, date_to
+
+    def render_availability(self, date_from, date_to, availability):
+        return JsonResponse({
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'doctors': [
+                {'id': pk, 'slots': [timezone.localtime(slot).isoformat() for slot in slots]}
+                for pk, slots in availability.items()
+            ],
+        })
+
+
+# поиск доктора по первым буквам для формы записи
+class DoctorSearchView(View):
+    limit = 10
 
-        return User.objects.filter(groups__name='Doctors')
+    def get(self, request, *args, **kwargs):
+        doctors = search_doctors(request.GET.get('q', ''), limit=self.limit)
+        return JsonResponse({
+            'doctors': [
+                {
+                    'id': doctor.id,
+                    'label': doctor.label,
+                    'first_name': doctor.first_name,
+                    'last_name': doctor.last_name,
+                    'cat_doctor': doctor.cat_doctor,
+                    'photo_url': doctor.photo_url,
+                }
+                for doctor in doctors
+            ],
+        })
 
 
 # новая заявка пациента
-class PatientNewAppointmentView(UserPassesTestMixin, CreateView):
+class PatientNewAppointmentView(RoleRequiredMixin, CreateView):
     model = Appointment
     form_class = PatientNewAppointmentForm
     template_name = 'hospital_app/patient_appointment_new.html'
     context_object_name = 'appointment'
     success_url = reverse_lazy('patient_appointment_new')
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Patient').exists()
-        allowed_groups = ['Patient', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [PATIENT, STAFF, ROOT]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -101,34 +179,17 @@ class PatientNewAppointmentView(UserPassesTestMixin, CreateView):
             messages.error(self.request, 'Дата начала приёма не может быть в прошлом.')
             return self.form_invalid(form)
 
-        # end_date_time = form.cleaned_data.get('end_date_time')
-        end_date_time = form.instance.start_date_time + timedelta(minutes=30)
-
-        conflicting_appointments_patient = Appointment.objects.filter(
-            patient=form.instance.patient,
-            start_date_time__lte=end_date_time,
-            end_date_time__gte=form.instance.start_date_time
-        )
-
-        if conflicting_appointments_patient.exists():
-            messages.error(self.request, 'У вас есть запись в это время.')
+        # Проверка пересечений выполняется уникальными индексами слотов при вставке
+        try:
+            self.object = book(form.instance)
+        except SlotConflict as e:
+            messages.error(self.request, str(e))
             return self.form_invalid(form)
 
-        end_date_time = form.instance.start_date_time + timedelta(minutes=30)
-
-        conflicting_appointments_doctor = Appointment.objects.filter(
-            doctor=form.instance.doctor,
-            start_date_time__lte=end_date_time,
-            end_date_time__gte=form.instance.start_date_time
-        )
-
-        if conflicting_appointments_doctor.exists():
-            messages.error(self.request, 'В это время у доктора уже есть приём, выбирете другое время.')
-            return self.form_invalid(form)
-
-        response = super().form_valid(form)
+        # Письмо доктору уходит из фоновой очереди, запрос его не ждёт
+        enqueue('appointment_booked', appointment_id=self.object.pk)
         messages.success(self.request, 'Запись успешно создана.')  # Сообщение об успешном создании записи
-        return response
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_form_kwargs(self):
         # Передаем request в форму через параметр request
@@ -137,27 +198,36 @@ class PatientNewAppointmentView(UserPassesTestMixin, CreateView):
         return kwargs
 
 
+# серия приёмов пациента (например, раз в неделю три месяца)
+class RecurringAppointmentView(RoleRequiredMixin, View):
+    allowed_roles = [PATIENT, STAFF, ROOT]
+
+    def post(self, request, *args, **kwargs):
+        form = RecurringAppointmentForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+
+        # Все даты серии проверяются одним запросом и вставляются одной транзакцией
+        results = book_series(request.user, form.cleaned_data['doctor'], form.occurrences(),
+                              form.cleaned_data['complaint'])
+        booked = sum(result['status'] == 'booked' for result in results)
+        return JsonResponse({'booked': booked, 'results': results}, status=201 if booked else 409)
+
+
 # ответ доктора
-class DoctorAnswerView(UserPassesTestMixin, UpdateView):
+class DoctorAnswerView(RoleRequiredMixin, UpdateView):
     model = Appointment
     form_class = DoctorAnswerForm
     template_name = 'hospital_app/doctor_answer.html'
     context_object_name = 'appointment'
     success_url = reverse_lazy('doctor_answer')
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Doctors').exists()
-        allowed_groups = ['Doctors', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [DOCTOR, STAFF, ROOT]
 
     def get_object(self, queryset=None):
         # Возвращает объект Appointment на основе переданного appointment_id из URL
-        return Appointment.objects.get(pk=self.kwargs['appointment_id'])
+        # вместе с доктором и пациентом одним запросом
+        queryset = Appointment.objects.select_related('doctor', 'patient')
+        return get_object_or_404(queryset, pk=self.kwargs['appointment_id'])
 
     def form_valid(self, form):
         # Устанавливаем doctor перед сохранением формы
@@ -165,6 +235,8 @@ class DoctorAnswerView(UserPassesTestMixin, UpdateView):
 
         # Ваша логика обработки формы
         response = super().form_valid(form)
+        if 'readings' in form.changed_data:
+            enqueue('appointment_answered', appointment_id=self.object.pk)
 
         messages.success(self.request, 'Запись успешно создана.')  # Сообщение об успешном создании записи
         return response
@@ -189,7 +261,7 @@ class DoctorAnswerView(UserPassesTestMixin, UpdateView):
         kwargs['appointment_id'] = self.kwargs['appointment_id']
 
         # Получаем имя пациента из объекта Appointment или из request.user
-        appointment = self.get_object()
+        appointment = self.object
         kwargs[
             'patient_name'] = appointment.patient.get_full_name() if appointment else self.request.user.get_full_name()
         kwargs['doctor_name'] = appointment.doctor.get_full_name() if appointment else self.request.user.get_full_name()
@@ -198,20 +270,11 @@ class DoctorAnswerView(UserPassesTestMixin, UpdateView):
 
 
 # список новых заявко пациента
-class PatientNewListView(UserPassesTestMixin, ListView):
+class PatientNewListView(RoleRequiredMixin, KeysetPaginationMixin, ListView):
     model = Appointment
     template_name = 'hospital_app/patient_history_new.html'  # Путь к вашему шаблону
     context_object_name = 'appointment'
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Patient').exists()
-        allowed_groups = ['Patient', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [PATIENT, STAFF, ROOT]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -225,25 +288,18 @@ class PatientNewListView(UserPassesTestMixin, ListView):
         user = self.request.user
 
         # Фильтруем записи по полю 'patient'
-        queryset = Appointment.objects.filter(Q(patient=user) & Q(readings__exact='')).order_by('-start_date_time')
+        queryset = Appointment.objects.filter(
+            Q(patient=user) & Q(status=Appointment.Status.PENDING)
+        ).select_related('doctor', 'patient').only(*HISTORY_FIELDS).order_by('-start_date_time', '-id')
         return queryset
 
 
 # список старых заявко пациента
-class PatientOldListView(UserPassesTestMixin, ListView):
+class PatientOldListView(RoleRequiredMixin, KeysetPaginationMixin, ListView):
     model = Appointment
     template_name = 'hospital_app/patient_history_old.html'  # Путь к вашему шаблону
     context_object_name = 'appointment'
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Patient').exists()
-        allowed_groups = ['Patient', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [PATIENT, STAFF, ROOT]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -257,26 +313,19 @@ class PatientOldListView(UserPassesTestMixin, ListView):
         user = self.request.user
 
         # Фильтруем записи по полю 'patient'
-        queryset = Appointment.objects.filter(Q(patient=user) & Q(readings__gt='')).order_by('-start_date_time')
+        queryset = Appointment.objects.filter(
+            Q(patient=user) & Q(status=Appointment.Status.ANSWERED)
+        ).select_related('doctor', 'patient').only(*HISTORY_FIELDS).order_by('-start_date_time', '-id')
 
         return queryset
 
 
 # список не отвеченых заявок для доктора
-class DoctorHistoryListView(UserPassesTestMixin, ListView):
+class DoctorHistoryListView(RoleRequiredMixin, KeysetPaginationMixin, ListView):
     model = Appointment
     template_name = 'hospital_app/doctor_history.html'  # Путь к вашему шаблону
     context_object_name = 'appointment'
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Doctors').exists()
-        allowed_groups = ['Doctors', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [DOCTOR, STAFF, ROOT]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -291,26 +340,18 @@ class DoctorHistoryListView(UserPassesTestMixin, ListView):
 
         # Фильтруем записи по полю 'patient'
 
-        queryset = Appointment.objects.filter(Q(doctor=user) & Q(readings__exact='')).order_by('-start_date_time')
-        print(queryset)
+        queryset = Appointment.objects.filter(
+            Q(doctor=user) & Q(status=Appointment.Status.PENDING)
+        ).select_related('doctor', 'patient').only(*HISTORY_FIELDS).order_by('-start_date_time', '-id')
         return queryset
 
 
 # список всех овтетов доктора
-class DoctorAllHistoryListView(UserPassesTestMixin, ListView):
+class DoctorAllHistoryListView(RoleRequiredMixin, KeysetPaginationMixin, ListView):
     model = Appointment
     template_name = 'hospital_app/doctor_history_all.html'  # Путь к вашему шаблону
     context_object_name = 'appointment'
-
-    def test_func(self):
-        # Проверяем, принадлежит ли текущий пользователь к нужной группе
-        # return self.request.user.groups.filter(name='Doctors').exists()
-        allowed_groups = ['Doctors', 'staff', 'root']
-        return self.request.user.groups.filter(name__in=allowed_groups).exists()
-
-    def handle_no_permission(self):
-        # Перенаправляем пользователя на домашнюю страницу
-        return redirect('home')
+    allowed_roles = [DOCTOR, STAFF, ROOT]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -324,12 +365,113 @@ class DoctorAllHistoryListView(UserPassesTestMixin, ListView):
         user = self.request.user
 
         # Фильтруем записи по полю 'doctor'
-        queryset = Appointment.objects.filter(Q(doctor=user) & Q(readings__gt='')).order_by('-start_date_time')
-        print(queryset)
+        queryset = Appointment.objects.filter(
+            Q(doctor=user) & Q(status=Appointment.Status.ANSWERED)
+        ).select_related('doctor', 'patient').only(*HISTORY_FIELDS).order_by('-start_date_time', '-id')
         return queryset
 
 
-class TagsAnalizeView(View):
+# потоковая выгрузка приёмов для руководства клиники
+class AppointmentExportView(RoleRequiredMixin, View):
+    allowed_roles = [STAFF, ROOT]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        try:
+            doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+            date_from = date.fromisoformat(request.GET['date_from']) if request.GET.get('date_from') else None
+            date_to = date.fromisoformat(request.GET['date_to']) if request.GET.get('date_to') else None
+        except ValueError:
+            return JsonResponse({'error': 'Неверные параметры запроса'}, status=400)
+        if export_format not in CONTENT_TYPES:
+            return JsonResponse({'error': 'Формат должен быть csv или jsonl'}, status=400)
+
+        queryset = export_queryset(doctor_id, date_from, date_to)
+        response = StreamingHttpResponse(export_lines(queryset, export_format),
+                                         content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="appointments.{export_format}"'
+        return response
+
+
+# Асинхронные варианты страниц только для чтения. Под ASGI запрос к ним не занимает
+# поток на время запросов к БД: данные читаются через async ORM, а шаблон рендерится
+# обработчиком Django уже с готовым списком.
+class AsyncHistoryMixin(AsyncRoleRequiredMixin):
+    async def get(self, request, *args, **kwargs):
+        self.page_result = await self.apaginate_queryset(self.get_queryset(), self.get_paginate_by(None))
+        self.object_list = self.page_result[2]
+        return self.render_to_response(self.get_context_data())
+
+    def paginate_queryset(self, queryset, page_size):
+        # Страница уже выбрана в get()
+        return self.page_result
+
+
+class AsyncPatientNewListView(AsyncHistoryMixin, PatientNewListView):
+    pass
+
+
+class AsyncPatientOldListView(AsyncHistoryMixin, PatientOldListView):
+    pass
+
+
+class AsyncDoctorHistoryListView(AsyncHistoryMixin, DoctorHistoryListView):
+    pass
+
+
+class AsyncDoctorAllHistoryListView(AsyncHistoryMixin, DoctorAllHistoryListView):
+    pass
+
+
+class AsyncDoctorListView(DoctorListView):
+    async def get(self, request, *args, **kwargs):
+        self.object_list = await aget_doctors()
+        return self.render_to_response(self.get_context_data())
+
+
+class AsyncAvailabilityView(AvailabilityView):
+    async def get(self, request, *args, **kwargs):
+        query = self.parse_query(request, await aget_doctors())
+        if isinstance(query, JsonResponse):
+            return query
+        doctor_ids, date_from, date_to = query
+        return self.render_availability(date_from, date_to, await aget_availability(doctor_ids, date_from, date_to))
+
+
+# поток новых и изменённых ожидающих приёмов доктора (Server-Sent Events)
+class DoctorEventsView(AsyncRoleRequiredMixin, View):
+    allowed_roles = [DOCTOR, STAFF, ROOT]
+
+    async def get(self, request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            # Под WSGI бесконечный ответ занял бы поток сервера целиком;
+            # на 204 EventSource перестаёт переподключаться, страница работает как раньше
+            return HttpResponse(status=204)
+        # Подписка до ответа: события между рендером страницы и чтением потока не теряются
+        return EventStreamResponse(broker.subscribe(doctor_channel(request.user.pk)))
+
+
+# файлы MEDIA_ROOT (фото пользователей) с проверкой доступа
+class MediaView(View):
+    def get(self, request, path, *args, **kwargs):
+        cache_control = media_access(request.user, path)
+        if cache_control is None:
+            # Чужой файл неотличим от несуществующего
+            raise Http404
+        return serve_media(request, path, cache_control)
+
+
+# метрики процесса для Prometheus
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        token = settings.METRICS_TOKEN
+        authorization = request.headers.get('Authorization', '')
+        if not (request.user.is_staff or token and hmac.compare_digest(authorization, f'Bearer {token}')):
+            raise PermissionDenied
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class TagsAnalizeView(CachedPageMixin, View):
     template_name = 'hospital_app/tags_analyzes.html'
 
     def get(self, request, *args, **kwargs):
@@ -339,7 +481,7 @@ class TagsAnalizeView(View):
         return render(request, self.template_name, context=context)
 
 
-class TagsMrtView(View):
+class TagsMrtView(CachedPageMixin, View):
     template_name = 'hospital_app/tags_mrt.html'
 
     def get(self, request, *args, **kwargs):
@@ -349,7 +491,7 @@ class TagsMrtView(View):
         return render(request, self.template_name, context=context)
 
 
-class TagsKtView(View):
+class TagsKtView(CachedPageMixin, View):
     template_name = 'hospital_app/tags_kt.html'
 
     def get(self, request, *args, **kwargs):
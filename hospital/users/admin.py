@@ -2,5 +2,30 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from users.models import User
+from users.roles import DOCTOR, PATIENT
+from users.thumbnails import update_thumbnails
 
-admin.site.register(User, UserAdmin)
+
+class HospitalUserAdmin(UserAdmin):
+    # Подсказки автодополнения в приёмах: для поля доктора - только доктора, для пациента - пациенты
+    autocomplete_roles = {
+        ('hospital_app', 'appointment', 'doctor'): DOCTOR,
+        ('hospital_app', 'appointment', 'patient'): PATIENT,
+    }
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        role = self.autocomplete_roles.get(
+            (request.GET.get('app_label'), request.GET.get('model_name'), request.GET.get('field_name'))
+        )
+        if role is not None:
+            queryset = queryset.filter(groups__name=role)
+        return queryset, may_have_duplicates
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'photo' in form.changed_data:
+            update_thumbnails(obj)
+
+
+admin.site.register(User, HospitalUserAdmin)
@@ -4,6 +4,8 @@ from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, PasswordChangeForm
 
+from .roles import has_role, DOCTOR
+
 
 class LoginUserForm(AuthenticationForm):
     username = forms.CharField(label='Логин', widget=forms.TextInput(attrs={'class': 'form-input'}))
@@ -66,7 +68,7 @@ class ProfileUserForm(forms.ModelForm):
         super(ProfileUserForm, self).__init__(*args, **kwargs)
 
         # Проверяем, является ли пользователь доктором
-        is_doctor = self.instance.groups.filter(name='Doctors').exists()
+        is_doctor = has_role(self.instance, DOCTOR)
 
         # Если пользователь не доктор, скрываем поле "Категория доктора"
         if not is_doctor:
@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from hospital_app.directory import invalidate_doctors
+from users.models import User
+from users.thumbnails import make_thumbnails
+
+
+def process(row):
+    # Выполняется в процессе пула: только файлы, без обращений к БД
+    pk, name = row
+    try:
+        make_thumbnails(name)
+    except OSError as e:
+        return pk, str(e)
+    return pk, None
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры уже загруженных фото пользователей пулом процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Процессов обработки; 1 - без пула, в текущем процессе')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help='Пересоздать и уже готовые миниатюры')
+
+    def handle(self, *args, **options):
+        queryset = User.objects.exclude(photo='').exclude(photo__isnull=True).order_by('pk')
+        if not options['force']:
+            queryset = queryset.filter(has_thumbnails=False)
+
+        workers = options['workers']
+        if workers > 1:
+            # Декодирование и сжатие изображений упираются в процессор - потоки здесь не помогут
+            pool = ProcessPoolExecutor(workers, initializer=django.setup)
+            run = pool.map
+        else:
+            pool = None
+            run = map
+
+        done = failed = 0
+        last_pk = 0
+        try:
+            while True:
+                # Пачки по возрастанию pk; флаг отмечается одним UPDATE на пачку
+                batch = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'photo')[:options['batch_size']])
+                if not batch:
+                    break
+                ready = []
+                for pk, error in run(process, batch):
+                    if error is None:
+                        ready.append(pk)
+                    else:
+                        failed += 1
+                        self.stderr.write(f'Пользователь #{pk}: {error}')
+                User.objects.filter(pk__in=ready).update(has_thumbnails=True)
+                done += len(ready)
+                last_pk = batch[-1][0]
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if done:
+            # update() не вызывает сигналы - справочник докторов сбрасывается здесь
+            invalidate_doctors()
+        self.stdout.write(f'Обработано фото: {done}, с ошибками: {failed}')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры фото'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.shortcuts import redirect
+from django.views import View
+
+from .roles import has_role, ahas_role
+
+
+async def aget_user(request):
+    # request.user ленив: первое обращение читает сессию и пользователя из БД,
+    # поэтому в асинхронном коде оно выполняется в потоке один раз за запрос
+    user = request.user
+    await sync_to_async(lambda: user.is_authenticated)()
+    return user
+
+
+class RoleRequiredMixin(UserPassesTestMixin):
+    # Доступ только пользователям из групп allowed_roles, остальных - на главную
+    allowed_roles = ()
+
+    def test_func(self):
+        return has_role(self.request.user, *self.allowed_roles)
+
+    def handle_no_permission(self):
+        return redirect('home')
+
+
+class AsyncRoleRequiredMixin:
+    # Та же проверка для представлений с async-обработчиками: синхронный
+    # UserPassesTestMixin.dispatch обратился бы к БД прямо из event loop.
+    # allowed_roles берётся из представления (обычно это синхронный вариант с RoleRequiredMixin)
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aget_user(request)
+        if not await ahas_role(user, *self.allowed_roles):
+            return redirect('home')
+        return await View.dispatch(self, request, *args, **kwargs)
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .thumbnails import photo_sources
+
 
 # Create your models here.
 
@@ -8,5 +10,13 @@ class User(AbstractUser):
     photo = models.ImageField(upload_to="users/%Y/%m/%d/", blank=True, null=True, verbose_name="Фотография")
     date_birth = models.DateTimeField(blank=True, null=True, verbose_name="Дата рождения")
     cat_doctor = models.CharField(max_length=500, blank=True, null=True, verbose_name="Категория доктора")
+    # Миниатюры фото созданы (users.thumbnails); иначе выводится исходное фото
+    has_thumbnails = models.BooleanField(default=False, editable=False, verbose_name="Миниатюры фото")
+
+    @property
+    def photo_sources(self):
+        if self.photo and self.has_thumbnails:
+            return photo_sources(self.photo)
+        return None
 
 
@@ -0,0 +1,57 @@
+from django.core.cache import cache
+
+# Названия групп, которые определяют роль пользователя
+PATIENT = 'Patient'
+DOCTOR = 'Doctors'
+STAFF = 'staff'
+ROOT = 'root'
+
+ROLES_CACHE_TIMEOUT = 300
+
+
+def roles_cache_key(user_id):
+    return f'users:roles:{user_id}'
+
+
+def get_roles(user):
+    # Набор групп пользователя: один раз за запрос (запоминается на объекте user)
+    # и не чаще раза в ROLES_CACHE_TIMEOUT между запросами (общий кеш)
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        key = roles_cache_key(user.pk)
+        roles = cache.get(key)
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(key, roles, ROLES_CACHE_TIMEOUT)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, *roles):
+    return not get_roles(user).isdisjoint(roles)
+
+
+async def aget_roles(user):
+    # То же для асинхронных представлений: кеш и группы читаются через async-API.
+    # user должен быть уже загружен (см. users.mixins.aget_user)
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        key = roles_cache_key(user.pk)
+        roles = await cache.aget(key)
+        if roles is None:
+            roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+            await cache.aset(key, roles, ROLES_CACHE_TIMEOUT)
+        user._roles = roles
+    return roles
+
+
+async def ahas_role(user, *roles):
+    return not (await aget_roles(user)).isdisjoint(roles)
+
+
+def invalidate_roles(user_ids):
+    cache.delete_many([roles_cache_key(user_id) for user_id in user_ids])
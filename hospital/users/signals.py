@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .roles import invalidate_roles
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def reset_roles_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add(...) / remove / clear - изменился сам пользователь
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_roles([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # group.user_set.add(...) - изменились пользователи из pk_set
+        invalidate_roles(pk_set)
+    elif action == 'pre_clear':
+        # После очистки участников группы уже не узнать - собираем их заранее
+        invalidate_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def reset_roles_on_group_change(sender, instance, created=False, **kwargs):
+    # Переименование или удаление группы меняет роли всех её участников
+    if not created:
+        invalidate_roles(instance.user_set.values_list('pk', flat=True))
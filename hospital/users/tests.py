@@ -1,3 +1,166 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from .roles import get_roles, has_role, DOCTOR, PATIENT
+from .thumbnails import THUMBNAIL_SIZES, make_thumbnails, photo_source, thumbnail_name
+
+
+class QueryBudgetTests(TestCase):
+    # Число запросов на страницу фиксировано и не зависит от количества пользователей
+    anonymous_budgets = {
+        'users:login': 0, 'users:register': 0,
+    }
+    user_budgets = {
+        'users:profile': 2, 'users:password_change': 2, 'users:password_change_done': 2,
+    }
+
+    def setUp(self):
+        self.patient_group = Group.objects.create(name='Patient')
+        self.user = self.make_user('patient')
+        cache.clear()
+
+    def make_user(self, username):
+        user = get_user_model().objects.create_user(username=username)
+        user.groups.add(self.patient_group)
+        return user
+
+    def assert_budgets(self, budgets):
+        for extra_users in (1, 10):
+            for i in range(extra_users):
+                self.make_user(f'user{extra_users}_{i}')
+            for name, budget in budgets.items():
+                with self.subTest(url=name, users=extra_users), self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_pages(self):
+        self.assert_budgets(self.anonymous_budgets)
+
+    def test_authenticated_pages(self):
+        self.client.force_login(self.user)
+        get_roles(self.user)
+        self.assert_budgets(self.user_budgets)
+
+    def test_logout(self):
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('users:logout'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+class RolesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patients = Group.objects.create(name=PATIENT)
+        self.doctors = Group.objects.create(name=DOCTOR)
+        self.user = get_user_model().objects.create_user(username='user')
+        self.user.groups.add(self.patients)
+
+    def fresh_user(self):
+        # Новый объект, как в следующем запросе
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_roles_cached_between_requests(self):
+        self.assertEqual(get_roles(self.fresh_user()), {PATIENT})
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(has_role(user, PATIENT))
+            self.assertFalse(has_role(user, DOCTOR))
+
+    def test_group_add_invalidates(self):
+        get_roles(self.fresh_user())
+        self.user.groups.add(self.doctors)
+        self.assertTrue(has_role(self.fresh_user(), DOCTOR))
+
+    def test_reverse_add_and_clear_invalidate(self):
+        get_roles(self.fresh_user())
+        self.doctors.user_set.add(self.user)
+        self.assertTrue(has_role(self.fresh_user(), DOCTOR))
+        self.patients.user_set.clear()
+        self.assertEqual(get_roles(self.fresh_user()), {DOCTOR})
+
+    def test_group_remove_invalidates(self):
+        get_roles(self.fresh_user())
+        self.user.groups.remove(self.patients)
+        self.assertFalse(has_role(self.fresh_user(), PATIENT))
+
+    def test_group_rename_invalidates(self):
+        get_roles(self.fresh_user())
+        self.patients.name = 'Пациенты'
+        self.patients.save()
+        self.assertEqual(get_roles(self.fresh_user()), {'Пациенты'})
+
+
+def jpeg_bytes(width, height):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(MEDIA_ROOT=self.media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        self.doctor = get_user_model().objects.create_user('doctor', 'doctor@example.com', first_name='Иван',
+                                                                last_name='Петров')
+        self.doctor.groups.add(Group.objects.create(name=DOCTOR))
+
+    def test_make_thumbnails(self):
+        name = default_storage.save('users/2024/01/31/photo.jpg', ContentFile(jpeg_bytes(1600, 1200)))
+        names = make_thumbnails(name)
+        self.assertEqual(len(names), len(THUMBNAIL_SIZES) * 2)
+        for size in THUMBNAIL_SIZES:
+            with default_storage.open(thumbnail_name(name, size, 'webp')) as file, Image.open(file) as image:
+                self.assertEqual((image.format, image.size), ('WEBP', (size, size)))
+        # Повторная обработка перезаписывает те же файлы
+        self.assertEqual(make_thumbnails(name), names)
+        self.assertEqual({photo_source(thumbnail) for thumbnail in names}, {name})
+        self.assertEqual(photo_source(name), name)
+
+    def test_profile_upload_creates_thumbnails(self):
+        self.client.force_login(self.doctor)
+        photo = SimpleUploadedFile('photo.jpg', jpeg_bytes(800, 800), content_type='image/jpeg')
+        response = self.client.post(reverse('users:profile'), {
+            'photo': photo, 'first_name': 'Иван', 'last_name': 'Петров', 'cat_doctor': 'Терапевт',
+            'date_birth_year': 1980, 'date_birth_month': 5, 'date_birth_day': 1,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.doctor.refresh_from_db()
+        self.assertTrue(self.doctor.has_thumbnails)
+        self.assertTrue(default_storage.exists(thumbnail_name(self.doctor.photo.name, 200, 'jpg')))
+
+        response = self.client.get(reverse('doctors_all'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, self.doctor.photo_sources.srcset)
+
+    def test_backfill_command(self):
+        self.doctor.photo = default_storage.save('users/2024/01/31/old.jpg', ContentFile(jpeg_bytes(300, 500)))
+        self.doctor.save()
+        broken = get_user_model().objects.create_user('broken')
+        broken.photo = default_storage.save('users/2024/01/31/broken.jpg', ContentFile(b'not an image'))
+        broken.save()
+
+        out, err = StringIO(), StringIO()
+        call_command('backfill_thumbnails', '--workers', '1', stdout=out, stderr=err)
+        self.assertIn('Обработано фото: 1, с ошибками: 1', out.getvalue())
+        self.doctor.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual((self.doctor.has_thumbnails, broken.has_thumbnails), (True, False))
+        # Справочник докторов сброшен и отдаёт миниатюры
+        self.assertContains(self.client.get(reverse('doctors_all')), self.doctor.photo_sources.webp_srcset)
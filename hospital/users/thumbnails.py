@@ -0,0 +1,99 @@
+import logging
+import posixpath
+from dataclasses import dataclass
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Фото выводятся квадратом 200x200; вторая ширина - для экранов с плотностью 2x
+THUMBNAIL_SIZES = (200, 400)
+# WebP для браузеров, которые его понимают, JPEG - запасной вариант
+THUMBNAIL_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+@dataclass(frozen=True)
+class PhotoSources:
+    # Готовые атрибуты <picture>: src и srcset для JPEG и srcset для WebP
+    src: str
+    srcset: str
+    webp_srcset: str
+
+
+def thumbnail_name(name, size, extension):
+    # users/2024/01/31/photo.png -> users/2024/01/31/thumbs/photo.png_200.webp: в имени миниатюры
+    # всё имя исходника, и фото photo.png и photo.jpg одного дня не делят миниатюры
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, 'thumbs', f'{filename}_{size}.{extension}')
+
+
+def photo_source(name):
+    # Имя исходного фото для миниатюры (обратное thumbnail_name); для исходника - оно само
+    directory, filename = posixpath.split(name)
+    if posixpath.basename(directory) != 'thumbs':
+        return name
+    return posixpath.join(posixpath.dirname(directory), filename.rpartition('_')[0])
+
+
+def render_thumbnails(file):
+    # Исходник декодируется один раз: JPEG сразу в уменьшенном масштабе (draft), затем
+    # квадрат самого большого размера; меньшие размеры получаются из него, а не из исходника
+    largest = max(THUMBNAIL_SIZES)
+    with Image.open(file) as image:
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        square = ImageOps.fit(image, (largest, largest), Image.LANCZOS)
+
+    for size in sorted(THUMBNAIL_SIZES, reverse=True):
+        if size != square.width:
+            square = square.resize((size, size), Image.LANCZOS)
+        for extension, options in THUMBNAIL_FORMATS.items():
+            buffer = BytesIO()
+            square.save(buffer, **options)
+            yield size, extension, buffer.getvalue()
+
+
+def make_thumbnails(name, storage=default_storage):
+    # Создаёт все миниатюры фото name в хранилище; возвращает их имена
+    with storage.open(name) as file:
+        rendered = list(render_thumbnails(file))
+    names = []
+    for size, extension, content in rendered:
+        thumbnail = thumbnail_name(name, size, extension)
+        # Имена постоянные: повторная обработка перезаписывает файлы, а не плодит копии
+        if storage.exists(thumbnail):
+            storage.delete(thumbnail)
+        names.append(storage.save(thumbnail, ContentFile(content)))
+    return names
+
+
+def photo_sources(photo):
+    # Ссылки строятся по именам, без обращения к хранилищу
+    def srcset(extension):
+        return ', '.join(f'{photo.storage.url(thumbnail_name(photo.name, size, extension))} {size}w'
+                         for size in THUMBNAIL_SIZES)
+
+    return PhotoSources(
+        src=photo.storage.url(thumbnail_name(photo.name, min(THUMBNAIL_SIZES), 'jpg')),
+        srcset=srcset('jpg'),
+        webp_srcset=srcset('webp'),
+    )
+
+
+def update_thumbnails(user):
+    # Вызывается после сохранения нового фото; без готовых миниатюр шаблоны выводят исходник
+    user.has_thumbnails = False
+    if user.photo:
+        try:
+            make_thumbnails(user.photo.name, user.photo.storage)
+        except OSError:
+            logger.warning('Не удалось создать миниатюры для %s', user.photo.name, exc_info=True)
+        else:
+            user.has_thumbnails = True
+    user.save(update_fields=['has_thumbnails'])
@@ -4,6 +4,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.views.generic import CreateView, UpdateView
 from django.contrib.auth.views import LoginView, PasswordChangeView
+from .thumbnails import update_thumbnails
 from .forms import LoginUserForm, RegisterUserForm, ProfileUserForm, UserPasswordChangeForm
 
 
@@ -48,6 +49,12 @@ class ProfileUser(UpdateView):
     def get_success_url(self):
         return reverse_lazy('users:profile')
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if 'photo' in form.changed_data:
+            update_thumbnails(self.object)
+        return response
+
     def get_object(self, queryset=None):
         return self.request.user
 